@@ -15,8 +15,13 @@ mc  = MCMC()
 c   = Calc()
 
 
-def FindBestParams(params,F,E,Const,ModelType):
-	best_P, success = leastsq(s.chi2_lm, params, args=(F,E,Const,ModelType), maxfev=1000)
+def FindBestParams(params,F,E,Const,ModelType,jacobian=False):
+	# Forward differences by default; jacobian=True uses the analytic
+	# Jacobian, with the parameters scaled by max(|params|, 1).
+	if jacobian:
+		best_P, success = leastsq(s.chi2_lm, params, args=(F,E,Const,ModelType), Dfun=s.chi2_lm_jac, diag=1./np.maximum(np.abs(params), 1.), maxfev=1000)
+	else:
+		best_P, success = leastsq(s.chi2_lm, params, args=(F,E,Const,ModelType), maxfev=1000)
 	return best_P
 
 def main():    
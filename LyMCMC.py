@@ -5,6 +5,7 @@ import sys
 from src.statistics import Stats
 from src.model import Model
 from src.mcmc import MCMC
+from src.runner import Runner
 
 s   = Stats()
 m   = Model()
@@ -129,13 +130,23 @@ def main():
 
     X = F, E, m.LyModel(Par,Const,ModelType)[0]
 
-    #chain, moves = mc.McMC(W,X,m.LyModel, ModelType, Par, Const, step,1.67e5)
-    chain, moves = mc.McMC(W,X,m.LyModel, ModelType, Par, Const, step,1.67e5)
-    
-    outfile = 'chains/chain_Q_'+sys.argv[1]
-    #np.savez(outfile, nh_bp = chain[:,0], max_f = chain[:,1], uf = chain[:,2], av = chain[:,3], v_X = chain[:,4], nh_X = chain[:,5], nh_ISM = chain[:,6])
-    #np.savez(outfile, nh_bp = chain[:,0], max_f = chain[:,1], uf = chain[:,2], av = chain[:,3], v_H = chain[:,4], nh_ISM = chain[:,5])
-    np.savez(outfile, nh_bp = chain[:,0], max_f = chain[:,1], uf = chain[:,2], av = chain[:,3], v_H = chain[:,4], nh_ISM = chain[:,5], b_BP = chain[:,6], T_BP = chain[:,7])
+    if sys.argv[1] == 'all':
+        # All 24 chains in one command, on a process pool, into chains/chains_Q.npz,
+        # which posterior.py reads like the 24 chain files of single runs
+        chains, moves = Runner().run(X, ModelType, Par, Const, step, 1.67e5, 24, outfile='chains/chains_Q.npz')
+        chain   = chains.reshape(-1,len(Par))
+    else:
+        #chain, moves = mc.McMC(W,X,m.LyModel, ModelType, Par, Const, step,1.67e5)
+        chain, moves = mc.McMC(W,X,m.LyModel, ModelType, Par, Const, step,1.67e5)
+        # To write the chain to disk every 1000 steps, resuming an interrupted run:
+        #chain, moves = mc.McMC(W,X,m.LyModel, ModelType, Par, Const, step,1.67e5, outfile='chains/chain_Q_'+sys.argv[1]+'.npy')
+        # To stop the chains once R_hat < 1.01 and ESS > 400 for every parameter:
+        #chains, moves, diagnostics = mc.McMCChains(W,X,m.LyModel, ModelType, Par, Const, step,1.67e5, n_chains=4, outfile='chains/chains_Q.npz')
+
+        outfile = 'chains/chain_Q_'+sys.argv[1]
+        #np.savez(outfile, nh_bp = chain[:,0], max_f = chain[:,1], uf = chain[:,2], av = chain[:,3], v_X = chain[:,4], nh_X = chain[:,5], nh_ISM = chain[:,6])
+        #np.savez(outfile, nh_bp = chain[:,0], max_f = chain[:,1], uf = chain[:,2], av = chain[:,3], v_H = chain[:,4], nh_ISM = chain[:,5])
+        np.savez(outfile, nh_bp = chain[:,0], max_f = chain[:,1], uf = chain[:,2], av = chain[:,3], v_H = chain[:,4], nh_ISM = chain[:,5], b_BP = chain[:,6], T_BP = chain[:,7])
     
     #'''
     Pout = chain[moves,:]
@@ -0,0 +1,717 @@
+#!/usr/bin/env python
+import multiprocessing
+import numpy as np
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from src.model import Model
+
+m   = Model()
+
+def setup(ModelType, n_pix=1400, n_data=700):
+    '''
+    Builds a synthetic Ly-alpha problem with the same layout as LyMCMC.py,
+    so that the model can be timed without access to the COS data files.
+
+    n_pix  => Number of pixels in the spectrum Wo (the model grid l has 2*n_pix points)
+    n_data => Number of pixels in the fitted spectrum W
+    '''
+    LyA         = 1215.6702
+    BetaPicRV   = 20.5
+    dwave       = 0.00997                       # COS G130M dispersion [Ang/pix]
+
+    Wo  = LyA + dwave*(np.arange(n_pix) - n_pix/2.)
+    W   = LyA + dwave*(np.arange(n_data) - n_data/2.)
+
+    # ISM parameters
+    v_ism, nh_ism, b_ism, T_ism = 10.0, 18.2, 2.9, 6000.
+    # Beta Pic parameters
+    v_bp, nh_bp, b_bp, T_bp     = 64.7, 18.6, 7.0, 1000.
+    # Extra component parameters
+    v_X, nh_X, b_X, T_X         = 70.0, 18.4, 7.0, 1000.
+    # Stellar emission line parameters
+    max_f, dp, uf, av           = 5.0e-10, 0.0, 313., 4.95
+    slope                       = -0.0008205
+    sigma_kernel                = 6.5
+
+    v   = np.arange(-len(Wo),len(Wo),1)         # RV values
+    l   = LyA*(1.0 + v/3e5)                     # Corresponding wavengths
+
+    continuum_fit = 1e-14*(1. + 0.1*(l-LyA))
+
+    if ModelType == 1:
+        Par     = [nh_bp,max_f,uf,av,slope]
+        Const   = [W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,nh_ism,b_ism,T_ism,v_bp,b_bp,T_bp,continuum_fit]
+    if ModelType == 2:
+        Par     = [nh_bp,max_f,uf,av,v_bp]
+        Const   = [W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,nh_ism,b_ism,T_ism,b_bp,T_bp,continuum_fit]
+    if ModelType == 3:
+        Par     = [nh_bp,max_f,uf,av,v_X,nh_X]
+        Const   = [W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,nh_ism,b_ism,T_ism,v_bp,b_bp,T_bp,b_X,T_X,continuum_fit]
+    if ModelType == 4:
+        Par     = [nh_bp,max_f,uf,av]
+        Const   = [W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,nh_ism,b_ism,T_ism,v_bp,b_bp,T_bp,continuum_fit]
+    if ModelType == 5:
+        Par     = [nh_bp,max_f,uf,av,v_bp,nh_ism]
+        Const   = [W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,b_ism,T_ism,b_bp,T_bp,continuum_fit]
+    if ModelType == 6:
+        Par     = [nh_bp,max_f,uf,av,v_X,nh_X,nh_ism]
+        Const   = [W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,b_ism,T_ism,v_bp,b_bp,T_bp,b_X,T_X,continuum_fit]
+    if ModelType == 7:
+        Par     = [max_f,uf,av,v_X,nh_X,nh_ism]
+        Const   = [W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,b_ism,T_ism,nh_bp,v_bp,b_bp,T_bp,b_X,T_X,continuum_fit]
+    if ModelType == 8:
+        Par     = [nh_bp,max_f,uf,av,v_bp,nh_ism,b_bp,T_bp]
+        Const   = [W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,b_ism,T_ism,continuum_fit]
+
+    return np.array(Par), Const
+
+def fixture(ModelType, seed=1):
+    '''
+    setup(ModelType) with synthetic data: the model F with errors E of 5%
+    of its peak and, unless seed is None, Gaussian noise drawn from
+    RandomState(seed). X = (F, E, model) is the data tuple of MCMC.McMC().
+
+    Returns Par, Const, F, E, X.
+    '''
+    Par, Const  = setup(ModelType)
+    model       = m.LyLikelihoodModel(Par,Const,ModelType)
+    E           = 0.05*model.max()*np.ones(len(model))
+    F           = model if seed is None else model + E*np.random.RandomState(seed).normal(0.,1.,len(model))
+    return Par, Const, F, E, (F, E, model)
+
+@contextmanager
+def quiet():
+    ''' Discards the output printed in the with block, e.g. by the samplers. '''
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def timeit(f, n=100):
+    ''' Returns the mean wall time of f() in seconds. '''
+    f()
+    t0  = time.time()
+    for i in range(n):
+        f()
+    return (time.time()-t0)/n
+
+def absorption():
+    Par, Const  = setup(8)
+    l, LyA      = Const[1], Const[2]
+    t = timeit(lambda: m.absorption(l,64.7,18.6,7.0,1000.,LyA))
+    print("absorption:\t\t%8.3f ms" % (1e3*t))
+
+def voigt():
+    '''
+    Accuracy and throughput of the Voigt backends of src/voigt.py over the
+    (a, u) range reached by ModelTypes 1-8.
+    '''
+    from src.voigt import Voigt
+    vf  = Voigt()
+    a   = np.logspace(-4,1,300)[:,None]
+    u   = np.concatenate((np.linspace(0,20,2001),np.logspace(np.log10(20),np.log10(5000),500)))[None,:]
+    H   = vf.wofz(a,u)
+    vf.make_table()
+
+    # Absorber-like input: small a, mostly wing points
+    A   = np.random.uniform(1e-4,1e-2,280000)
+    U   = np.random.uniform(0.,3000.,280000)
+    for backend in ['wofz','humlicek','table']:
+        err = np.max(np.abs(vf(a,u,backend)/H-1.))
+        t   = timeit(lambda: vf(A,U,backend), 10)
+        print("Voigt %-8s:\tmax rel. error %.1e\t%6.1f ns/point" % (backend, err, 1e9*t/len(A)))
+    for ModelType in [5,8]:
+        Par, Const  = setup(ModelType)
+        for backend in ['wofz','humlicek','table']:
+            Model.voigt_backend = backend
+            t = timeit(lambda: m.LyLikelihoodModel(Par,Const,ModelType), 50)
+            print("LyLikelihoodModel ModelType %d, %-8s:\t%8.3f ms" % (ModelType, backend, 1e3*t))
+        Model.voigt_backend = 'wofz'
+
+def jacobian():
+    '''
+    leastsq fits of synthetic data from a perturbed start, with forward
+    differences and with the analytic Jacobian as Dfun, as
+    LyFit.FindBestParams(jacobian=False/True).
+    '''
+    from scipy.optimize import leastsq
+    from src.statistics import Stats
+    s   = Stats()
+    for ModelType in [2,5,8]:
+        Par, Const, F, E, X = fixture(ModelType)
+        start       = Par*(1. + 0.002*np.random.RandomState(2).normal(0.,1.,len(Par)))
+        for Dfun in [None, s.chi2_lm_jac]:
+            diag = 1./np.maximum(np.abs(start), 1.) if Dfun else None
+            t0  = time.time()
+            P, cov, info, msg, ier = leastsq(s.chi2_lm, start, args=(F,E,Const,ModelType), Dfun=Dfun, diag=diag, maxfev=1000, full_output=1)
+            t   = time.time()-t0
+            print("leastsq ModelType %d, %-10s: %4d model + %3d Jacobian evaluations, %6.3f s, chi2_lm %.4g, ier %d"
+                  % (ModelType, 'analytic' if Dfun else 'forward', info['nfev'], info.get('njev', 0), t, np.sum(s.chi2_lm(P,F,E,Const,ModelType)), ier))
+
+def jacobian_zero():
+    '''
+    Regression check of Stats.chi2_lm_jac for parameters that start at
+    zero: a leastsq fit of noiseless ModelType 1 data from slope=0 must
+    recover the slope with the analytic Jacobian as with forward
+    differences, as LyFit.FindBestParams(jacobian=False/True).
+    '''
+    from scipy.optimize import leastsq
+    from src.statistics import Stats
+    s   = Stats()
+    ModelType   = 1
+    Par, Const, F, E, X = fixture(ModelType, seed=None)
+    start       = np.array(Par)
+    start[-1]   = 0.
+    chi2        = {}
+    for Dfun in [None, s.chi2_lm_jac]:
+        diag    = 1./np.maximum(np.abs(start), 1.) if Dfun else None
+        P       = leastsq(s.chi2_lm, start, args=(F,E,Const,ModelType), Dfun=Dfun, diag=diag, maxfev=1000)[0]
+        name    = 'analytic' if Dfun else 'forward'
+        chi2[name] = np.sum(s.chi2_lm(P,F,E,Const,ModelType))
+        print("leastsq ModelType 1 from slope=0, %-8s: slope %.4g (true %.4g), chi2_lm %.3g" % (name, P[-1], Par[-1], chi2[name]))
+        assert abs(P[-1]/Par[-1] - 1.) < 1e-3, "slope not recovered with the %s Jacobian" % name
+    # Noiseless data: both fits must leave far less than one sigma per pixel
+    assert chi2['analytic'] < 1e-3*len(F), "analytic Jacobian fit from slope=0 did not converge"
+
+def batch(n_sets=32):
+    for ModelType in range(1,9):
+        Par, Const  = setup(ModelType)
+        Ps          = Par*(1. + 1e-3*np.random.normal(0.,1.,(n_sets,len(Par))))
+        t_loop  = timeit(lambda: [m.LyModel(P,Const,ModelType) for P in Ps], 3)
+        t_batch = timeit(lambda: m.LyModelBatch(Ps,Const,ModelType), 3)
+        print("LyModelBatch ModelType %d, %d sets:\t%8.3f ms (loop %8.3f ms)" % (ModelType, n_sets, 1e3*t_batch, 1e3*t_loop))
+
+def emulator():
+    '''
+    Accuracy and speed of the absorption emulator of src/emulator.py
+    against the exact absorption(), alone and inside LyModel.
+    '''
+    from src.emulator import Emulator
+    Par, Const  = setup(8)
+    l, LyA      = Const[1], Const[2]
+    e           = Emulator()
+    t0          = time.time()
+    e.build(LyA)
+    print("Emulator build:\t\t%8.3f s" % (time.time()-t0))
+    print("Emulator accuracy:\tmax %.1e, mean %.1e" % e.accuracy(l,LyA))
+
+    n_sets      = 32
+    rng         = np.random.RandomState(0)
+    v, nh, T    = rng.uniform(-100.,100.,n_sets), rng.uniform(17.,19.,n_sets), rng.uniform(500.,5000.,n_sets)
+    t_e = timeit(lambda: e.absorption(l,64.7,18.6,7.0,1000.,LyA))
+    t_m = timeit(lambda: m.absorption(l,64.7,18.6,7.0,1000.,LyA))
+    print("absorption emulated:\t%8.3f ms (exact %8.3f ms)" % (1e3*t_e, 1e3*t_m))
+    t_e = timeit(lambda: e.absorption(l,v,nh,0.,T,LyA), 20)
+    t_m = timeit(lambda: m.absorption(l,v,nh,0.,T,LyA), 20)
+    print("absorption emulated, %d sets:\t%8.3f ms (exact %8.3f ms)" % (n_sets, 1e3*t_e, 1e3*t_m))
+
+    for ModelType in [5,8]:
+        Par, Const  = setup(ModelType)
+        t_m = timeit(lambda: m.LyLikelihoodModel(Par,Const,ModelType), 50)
+        F   = m.LyLikelihoodModel(Par,Const,ModelType)
+        Model.emulator = e
+        t_e = timeit(lambda: m.LyLikelihoodModel(Par,Const,ModelType), 50)
+        err = np.max(np.abs(m.LyLikelihoodModel(Par,Const,ModelType)-F))/F.max()
+        Model.emulator = None
+        print("LyLikelihoodModel ModelType %d, emulated:\t%8.3f ms (exact %8.3f ms), max difference %.1e of peak" % (ModelType, 1e3*t_e, 1e3*t_m, err))
+
+def lines():
+    '''
+    line_absorption() of a cloud seen in the O I 1302, Si II 1304 and
+    C II 1334/1335 lines, in one stacked call and species by species, and
+    a check that the H I damping wing is kept beyond the 5 Ang margin.
+    '''
+    l       = np.arange(1299., 1340., 0.002)
+    logN    = {'OI': 14.5, 'SiII': 13., 'CII': 14., 'CII*': 13.5}
+    t_s = timeit(lambda: m.line_absorption(l,20.,logN,2.,8000.), 20)
+    t_l = timeit(lambda: [m.line_absorption(l,20.,{sp: logN[sp]},2.,8000.) for sp in logN], 20)
+    print("line_absorption, %d pixels:\t%8.3f ms (per species %8.3f ms)" % (len(l), 1e3*t_s, 1e3*t_l))
+
+    # Damping wing of H I 1215.67 at log N = 20, 6.7-9.7 Ang from the line
+    l_wing  = np.arange(1206., 1209., 0.01)
+    tau     = -np.log(m.line_absorption(l_wing,0.,{'HI': 20.},7.,1000.))
+    print("line_absorption H I wing 6.7-9.7 Ang from the line, log N = 20: optical depth %.1e-%.1e" % (tau.min(), tau.max()))
+    assert tau.min() > 0., "H I damping wing outside the line window"
+
+def grid(tol=1e-4):
+    '''
+    LyLikelihoodModel on the adaptive grid of adaptive_grid() against the
+    uniform 1 km/s grid, and against a converged (tol=1e-6) adaptive grid.
+    '''
+    for ModelType in range(1,9):
+        Par, Const  = setup(ModelType)
+        C_a         = m.adaptive_grid(Par,Const,ModelType,tol=tol)
+        C_ref       = m.adaptive_grid(Par,Const,ModelType,tol=1e-6)
+        F, F_a, F_ref = [m.LyLikelihoodModel(Par,C,ModelType) for C in (Const, C_a, C_ref)]
+        t   = timeit(lambda: m.LyLikelihoodModel(Par,Const,ModelType), 50)
+        t_a = timeit(lambda: m.LyLikelihoodModel(Par,C_a,ModelType), 50)
+        print("adaptive grid ModelType %d: %4d points (uniform %d), %6.3f ms (uniform %6.3f ms), difference %.1e (uniform %.1e) of peak"
+              % (ModelType, len(C_a[1]), len(Const[1]), 1e3*t_a, 1e3*t, np.abs(F_a-F_ref).max()/F_ref.max(), np.abs(F-F_ref).max()/F_ref.max()))
+
+def operator(n_sets=32):
+    '''
+    The fused LSF convolution + interpolation of lsf_operator() against
+    convolve() followed by interp(), for one spectrum and a batch.
+    '''
+    for name, (Par, Const) in [('uniform', setup(8)), ('adaptive', (setup(8)[0], m.adaptive_grid(*setup(8)+(8,))))]:
+        W, l, sk    = Const[0], Const[1], Const[4]
+        f           = np.random.RandomState(0).rand(n_sets, len(l))
+        op, kernel  = m.lsf_operator(W,l,sk), m.lsf(W,l,sk)
+        t_1 = timeit(lambda: op(f[0]), 200)
+        t_2 = timeit(lambda: m.interp(W,l,m.convolve(f[0],kernel)), 200)
+        t_b = timeit(lambda: op(f), 50)
+        t_c = timeit(lambda: m.interp(W,l,m.convolve(f,kernel)), 50)
+        print("LSF operator, %-8s grid: %6.3f ms (convolve+interp %6.3f ms), %d spectra %6.3f ms (%6.3f ms), difference %.1e"
+              % (name, 1e3*t_1, 1e3*t_2, n_sets, 1e3*t_b, 1e3*t_c, np.abs(op(f)-m.interp(W,l,m.convolve(f,kernel))).max()))
+
+def steps(use_workspace, n=3000, ModelType=8):
+    '''
+    Runs n Metropolis likelihood evaluations as in MCMC.McMC(), with or
+    without a Workspace, and prints the steps per second and the peak RSS
+    of the process.
+    '''
+    import resource
+    from src.statistics import Stats
+    from src.workspace import Workspace
+    s           = Stats()
+    Par, Const, F, E, X = fixture(ModelType)
+    ws          = Workspace(Const,ModelType) if use_workspace else None
+    jumps       = 1e-4*Par*np.random.RandomState(2).normal(0.,1.,(n,len(Par)))
+
+    t0  = time.time()
+    for jump in jumps:
+        P = Par + jump
+        if ws is None:
+            L = s.Merit((F,E,m.LyLikelihoodModel(P,Const,ModelType)))
+        else:
+            L = np.exp(-ws.chi2(P,F,E)/2.)
+    t   = time.time()-t0
+    print("%s:\t%8.0f steps/s, peak RSS %6.1f MB" % ('workspace' if use_workspace else 'LyLikelihoodModel', n/t,
+          resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.))
+
+def workspace():
+    ''' steps() with and without a Workspace, each in a fresh process. '''
+    for use_workspace in ['0','1']:
+        sys.stdout.write(subprocess.check_output([sys.executable, __file__, 'steps', use_workspace]).decode())
+
+def kernels(n_check=400):
+    '''
+    Checks the kernels of src/kernels.py against the NumPy path of
+    Model.emission() and Model.absorption() for both Voigt backends, with
+    the tolerances below: to rounding against 'humlicek', which the kernels
+    implement, and to the accuracy of the Humlicek approximation against
+    'wofz'. Without numba the kernels run as Python loops on the n_check
+    grid points around Ly-alpha, so the same check covers both backends;
+    the Model.jit timings then are skipped, and Model.jit is checked to
+    fall back to the NumPy path with a warning.
+    '''
+    import warnings
+    from src import kernels
+    # Largest relative emission and absolute transmission errors
+    tolerance   = {'humlicek': (1e-12, 1e-9), 'wofz': (1e-6, 1e-8)}
+    Par, Const  = setup(8)
+    l, LyA      = Const[1], Const[2]
+    if not kernels.available:
+        l       = l[(len(l)-n_check)//2:(len(l)+n_check)//2]
+    cont        = np.broadcast_to(1e-14, l.shape)
+    w, mass, fosc, delta, abund = m.transitions(LyA)
+    for backend in ['humlicek','wofz']:
+        Model.voigt_backend = backend
+        f_ref   = m.emission(LyA,20.5,l,5e-10,0.05,313.,4.95,1e-14)
+        f       = kernels.emission(l,LyA-0.05+LyA*20.5/3e5,LyA+0.05+LyA*20.5/3e5,5e-10,313.,4.95,cont,np.empty(l.shape))
+        err_f   = np.abs(f/f_ref-1.).max()
+        err_a   = 0.
+        for nh, T in [(18.6,1000.),(14.,100.),(21.,8000.)]:
+            a_ref   = m.absorption(l,64.7,nh,7.0,T,LyA)
+            a       = kernels.absorption(l,64.7,m.c_light,abund[:,0]*10**nh,m.doppler_width(7.0,T,mass[:,0]),
+                                         w[:,0],fosc[:,0],delta[:,0],np.empty(l.shape))
+            err_a   = max(err_a, np.abs(a-a_ref).max())
+        print("kernels (%s) against NumPy %-8s:\temission max rel. error %.1e (tolerance %.0e), transmission max abs. error %.1e (%.0e)"
+              % ('numba' if kernels.available else 'Python loops', backend, err_f, tolerance[backend][0], err_a, tolerance[backend][1]))
+        assert err_f < tolerance[backend][0] and err_a < tolerance[backend][1], "kernels disagree with the %s backend" % backend
+    Model.voigt_backend = 'wofz'
+
+    if not kernels.available:
+        Model.jit   = True
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            F_jit   = m.LyLikelihoodModel(Par,Const,8)
+        Model.jit   = False
+        assert caught and np.array_equal(F_jit, m.LyLikelihoodModel(Par,Const,8)), "Model.jit did not fall back to NumPy"
+        print("kernels: SKIPPED Model.jit timings, numba is not installed; Model.jit falls back to NumPy with a warning")
+        return
+    Model.voigt_backend = 'humlicek'
+    for ModelType in range(1,9):
+        Par, Const  = setup(ModelType)
+        F           = m.LyLikelihoodModel(Par,Const,ModelType)
+        t           = timeit(lambda: m.LyLikelihoodModel(Par,Const,ModelType), 50)
+        Model.jit   = True
+        F_jit       = m.LyLikelihoodModel(Par,Const,ModelType)
+        t_jit       = timeit(lambda: m.LyLikelihoodModel(Par,Const,ModelType), 50)
+        Model.jit   = False
+        err         = np.abs(F_jit-F).max()/F.max()
+        print("LyLikelihoodModel ModelType %d, jit:\t%8.3f ms (NumPy humlicek %8.3f ms, %.2fx), max rel. difference %.1e"
+              % (ModelType, 1e3*t_jit, 1e3*t, t/t_jit, err))
+        assert err < 1e-9, "jit LyLikelihoodModel disagrees with NumPy for ModelType %d" % ModelType
+    Model.voigt_backend = 'wofz'
+
+def threads(n_pix=20000):
+    '''
+    LyLikelihoodModel on a grid of 4*n_pix points evaluated serially and
+    in wavelength chunks on 2 and 4 threads (Model.n_threads), with the
+    largest difference from the serial model.
+    '''
+    for ModelType in [2,8]:
+        Par, Const  = setup(ModelType, n_pix=n_pix)
+        F           = m.LyLikelihoodModel(Par,Const,ModelType)
+        for n_threads in [1,2,4]:
+            Model.n_threads = n_threads
+            F_t         = m.LyLikelihoodModel(Par,Const,ModelType)
+            t           = timeit(lambda: m.LyLikelihoodModel(Par,Const,ModelType), 10)
+            print("LyLikelihoodModel ModelType %d, %d points, %d threads:\t%8.2f ms, max rel. difference %.1e"
+                  % (ModelType, len(Const[1]), n_threads, 1e3*t, np.abs(F_t-F).max()/F.max()))
+        Model.n_threads = 1
+    m.close()
+
+def sparse_tau():
+    '''
+    absorption(), line_absorption() and LyLikelihoodModel with
+    Model.tau_min = 1e-6 against the default of evaluating every pixel
+    (tau_min = 0): time, the fraction of the grid left at a transmission of
+    exactly 1 and the largest difference (of peak for LyLikelihoodModel).
+    The H+D absorbers of the fits never fall below 1e-6 on the grid, which
+    is why the cutoff is off by default.
+    '''
+    Par, Const  = setup(8)
+    l, LyA      = Const[1], Const[2]
+    l_OI        = 1302.1685*(1. + (l/LyA-1.))
+    cases       = [('ISM H+D, log N 18.2',      lambda: m.absorption(l,10.,18.2,2.9,6000.,LyA)),
+                   ('beta Pic H+D, log N 18.6', lambda: m.absorption(l,64.7,18.6,7.0,1000.,LyA)),
+                   ('H+D, log N 14',            lambda: m.absorption(l,10.,14.,2.9,6000.,LyA)),
+                   ('O I + Si II, log N 14.5',  lambda: m.line_absorption(l_OI,10.,{'OI':14.5,'SiII':13.5},2.9,6000.)),
+                   ('LyLikelihoodModel 8',      lambda: m.LyLikelihoodModel(Par,Const,8))]
+    for name, f in cases:
+        Model.tau_min = 0.
+        ref, t_ref  = f(), timeit(f, 100)
+        Model.tau_min = 1e-6
+        out, t      = f(), timeit(f, 100)
+        Model.tau_min = 0.
+        scale       = ref.max() if name.startswith('Ly') else 1.
+        print("tau_min %-24s:\t%6.3f ms (every pixel %6.3f ms), %3.0f%% of the grid at 1, max difference %.1e"
+              % (name, 1e3*t, 1e3*t_ref, 100.*np.mean(out == 1.), np.abs(out-ref).max()/scale))
+
+def clouds(n_max=5):
+    '''
+    LyLikelihoodModel for src.clouds.Clouds models with 2 to n_max clouds
+    whose velocity and column density are free, with the clouds evaluated
+    in one stacked cloud_absorption() call and one absorption() call each.
+    '''
+    from src.clouds import Clouds
+    Par, Const  = setup(8)
+    p           = m.unpack(Par,Const,8)
+    for n in range(2,n_max+1):
+        names   = ['c%d' % i for i in range(n)]
+        free    = ['max_f','uf','av'] + ['%s_%s' % (x,c) for c in names for x in ['v','nh']]
+        for i, c in enumerate(names):
+            p.update([('v_'+c, -40.+30.*i), ('nh_'+c, 17.+0.3*i), ('b_'+c, 3.), ('T_'+c, 3000.)])
+        ModelType   = Clouds(names, free)
+        P, C        = [p[x] for x in ModelType.free], [p[x] for x in ModelType.fixed]
+        q           = m.unpack(P,C,ModelType)
+        t           = timeit(lambda: m.LyLikelihoodModel(P,C,ModelType), 50)
+        t_a         = timeit(lambda: m.cloud_absorption(q,names), 50)
+        t_loop      = timeit(lambda: [m.absorption(q['l'],q['v_'+c],q['nh_'+c],q['b_'+c],q['T_'+c],q['LyA']) for c in names], 50)
+        print("Clouds, %d clouds:\tLyLikelihoodModel %6.3f ms, stacked absorption %6.3f ms (one call per cloud %6.3f ms)"
+              % (n, 1e3*t, 1e3*t_a, 1e3*t_loop))
+
+def lsf_table(n_offsets=161):
+    '''
+    LyLikelihoodModel with a tabulated LSF (Model.lsf_table). A table of
+    Gaussians of the width of K() checks the engine; a COS-like table with
+    a core of 6.0-7.2 pixels FWHM over 1150-1300 Ang and a 2% wing of 20
+    pixels standard deviation, n_offsets pixels wide, gives the timings,
+    on the uniform grid and on the grid of adaptive_grid().
+    '''
+    from src.lsf import LSFTable
+    ModelType   = 2
+    Par, Const  = setup(ModelType)
+    F           = m.LyLikelihoodModel(Par,Const,ModelType)
+    t           = timeit(lambda: m.LyLikelihoodModel(Par,Const,ModelType), 50)
+    x           = np.arange(n_offsets) - (n_offsets-1)//2
+    waves       = [1150.,1200.,1250.,1300.]
+
+    Model.lsf_table = LSFTable(waves, [np.exp(-0.5*(x/(6.5/2.3548))**2)]*len(waves))
+    print("LSF table of K() Gaussians: max rel. difference from K() %.1e" % (np.abs(m.LyLikelihoodModel(Par,Const,ModelType)-F).max()/F.max()))
+
+    Model.lsf_table = LSFTable(waves, [np.exp(-0.5*(x/(fwhm/2.3548))**2) + 0.02*np.exp(-0.5*(x/20.)**2) for fwhm in [6.0,6.3,6.8,7.2]])
+    t0          = time.time()
+    m.LyLikelihoodModel(Par,Const,ModelType)
+    t_build     = time.time()-t0
+    t_table     = timeit(lambda: m.LyLikelihoodModel(Par,Const,ModelType), 50)
+    Const_a     = m.adaptive_grid(Par,Const,ModelType)
+    t_a         = timeit(lambda: m.LyLikelihoodModel(Par,Const_a,ModelType), 50)
+    Model.lsf_table = None
+    print("LSF table, %d offsets:\tbuild %6.1f ms, LyLikelihoodModel %6.3f ms, on %d adaptive points %6.3f ms (Gaussian K() %6.3f ms)"
+          % (n_offsets, 1e3*t_build, 1e3*t_table, len(Const_a[1]), 1e3*t_a, 1e3*t))
+
+def ensemble(n_steps=400, n_walkers=32, prior=0.1):
+    '''
+    Effective samples per second of MCMC.McMCEnsemble() against the
+    single walker MCMC.McMC() on synthetic data, for ModelTypes 5 and 8.
+    McMC gets the same number of likelihood evaluations and the best
+    diagonal steps, 2.38/sqrt(n_params) times the posterior standard
+    deviations from the ensemble run. The second half of each chain is
+    used; the effective sample size is that of the worst parameter.
+
+    Both samplers use the Gaussian prior of metropolis(): with flat priors
+    the posterior has no bound along max_f/uf/av, where the Voigt profiles
+    of the star, whose core is absorbed, become Lorentzians of the same
+    wings.
+    '''
+    from src.mcmc import MCMC
+    mc      = MCMC()
+    for ModelType in [5,8]:
+        Par, Const, F, E, X = fixture(ModelType)
+        lnprior     = lambda Q: -0.5*np.sum(((Q-Par)/(prior*Par))**2, axis=-1)
+
+        with quiet():
+            np.random.seed(2)
+            t0          = time.time()
+            chain, chi2, moves = mc.McMCEnsemble(Const[0],X,m.LyModel,ModelType,Par,Const,1e-3*np.abs(Par),n_steps,n_walkers,
+                                                 seed=3,lnprior=lnprior)
+            t_ens       = time.time()-t0
+            chain       = chain[n_steps//2:]
+            step        = 2.38/np.sqrt(len(Par))*chain.reshape(-1,len(Par)).std(axis=0)
+            t0          = time.time()
+            chain_mc, moves_mc = mc.McMC(Const[0],X,m.LyModel,ModelType,Par,Const,step,n_steps*n_walkers,lnprior=lnprior)
+            t_mc        = time.time()-t0
+            chain_mc    = chain_mc[n_steps*n_walkers//2:]
+
+        ess     = min(chain.shape[0]*n_walkers/mc.AutocorrTime(chain[:,:,i]) for i in range(len(Par)))
+        ess_mc  = min(len(chain_mc)/mc.AutocorrTime(chain_mc[:,i:i+1]) for i in range(len(Par)))
+        print("ModelType %d, %d evaluations: McMCEnsemble %6.1f s, acceptance %4.1f%%, %6.2f ESS/s; McMC %6.1f s, acceptance %4.1f%%, %6.2f ESS/s"
+              % (ModelType, n_steps*n_walkers, t_ens, 100.*moves/(n_steps*n_walkers), ess/t_ens, t_mc, 100.*moves_mc/(n_steps*n_walkers), ess_mc/t_mc))
+
+def adaptive(n_steps=20000, adapt=5000, prior=0.1):
+    '''
+    Effective samples per likelihood evaluation of MCMC.McMC() with the
+    adaptive proposal against the fixed steps of LyMCMC.py, on synthetic
+    data for ModelTypes 5 and 8. Both use the Gaussian prior of ensemble(),
+    and the samples after the adaptation window; the effective sample size
+    is that of the worst parameter. The acceptance after adaptation must be
+    within 0.1 of MCMC.target_acceptance.
+    '''
+    from src.mcmc import MCMC
+    mc      = MCMC()
+    steps   = {5: np.array([0.05,1e-11,0.01,.002,3.,0.05]),
+               8: np.array([0.05,1e-11,0.01,.002,3.,0.05,0.5,100])}
+    for ModelType in [5,8]:
+        Par, Const, F, E, X = fixture(ModelType)
+        lnprior     = lambda Q: -0.5*np.sum(((Q-Par)/(prior*Par))**2, axis=-1)
+
+        results     = []
+        for n_adapt in [0, adapt]:
+            with quiet():
+                np.random.seed(2)
+                chain, moves = mc.McMC(Const[0],X,m.LyModel,ModelType,Par,Const,steps[ModelType],n_steps,
+                                       lnprior=lnprior,adapt=n_adapt)
+            chain       = chain[adapt:]
+            accepted    = np.mean(np.any(np.diff(chain,axis=0) != 0, axis=1))
+            ess         = min(len(chain)/mc.AutocorrTime(chain[:,i:i+1]) for i in range(len(Par)))
+            results    += [accepted, ess/n_steps]
+        print("ModelType %d, %d steps: fixed steps acceptance %4.1f%%, %.1e ESS/evaluation; adaptive acceptance %4.1f%%, %.1e ESS/evaluation"
+              % (ModelType, n_steps, 100.*results[0], results[1], 100.*results[2], results[3]))
+        assert abs(results[2] - mc.target_acceptance) < 0.1, "adapted acceptance %.3f is off target" % results[2]
+
+def convergence(n_steps=40000, n_chains=4, check=1000, adapt=5000, prior=0.1):
+    '''
+    MCMC.McMCChains() with early stopping on synthetic data for ModelType
+    5, with the adaptive proposal and the prior of adaptive(): the step at
+    which every parameter has split-R_hat < 1.01 and 400 effective samples
+    over at least 50 autocorrelation times, against the n_steps budget, and
+    the final diagnostics.
+    '''
+    from src.mcmc import MCMC
+    mc          = MCMC()
+    ModelType   = 5
+    Par, Const, F, E, X = fixture(ModelType)
+    lnprior     = lambda Q: -0.5*np.sum(((Q-Par)/(prior*Par))**2, axis=-1)
+    step        = np.array([0.05,1e-11,0.01,.002,3.,0.05])
+
+    with quiet():
+        t0          = time.time()
+        chain, moves, diagnostics = mc.McMCChains(Const[0],X,m.LyModel,ModelType,Par,Const,step,n_steps,n_chains,check,
+                                                  seed=0,lnprior=lnprior,adapt=adapt)
+        t           = time.time()-t0
+        t_diag      = timeit(lambda: mc.Diagnostics(chain[len(chain)//2:]), 10)
+    print("%d chains stopped at step %d of %d (%.0f%% of the evaluations) in %.1f s; diagnostics %.1f ms per check"
+          % (n_chains, len(chain), n_steps, 100.*len(chain)/n_steps, t, 1e3*t_diag))
+    print("R_hat %s" % ' '.join('%.4f' % r for r in diagnostics['r_hat']))
+    print("ESS   %s" % ' '.join('%.0f' % e for e in diagnostics['ess']))
+
+def writer(n_steps=5000, block=1000):
+    '''
+    MCMC.McMC() with the chain streamed to disk by src.writer.ChainWriter:
+    the time per step against the in-memory chain, and whether a run
+    interrupted after 2.5 blocks and resumed from its checkpoint gives the
+    same chain as an uninterrupted one.
+    '''
+    import shutil
+    import tempfile
+    from src.mcmc import MCMC
+    mc          = MCMC()
+    ModelType   = 5
+    Par, Const, F, E, X = fixture(ModelType, seed=None)
+    step        = np.array([0.05,1e-11,0.01,.002,3.,0.05])
+    calls       = [0]
+    def interrupt(Q):
+        calls[0] += 1
+        if calls[0] == 5*block//2:
+            raise KeyboardInterrupt
+        return np.zeros(len(Q))
+
+    directory   = tempfile.mkdtemp()
+    with quiet():
+        try:
+            times   = []
+            for outfile in [None, os.path.join(directory, 'chain.npy')]:
+                np.random.seed(0)
+                t0      = time.time()
+                chain   = mc.McMC(Const[0],X,m.LyModel,ModelType,Par,Const,step,n_steps,outfile=outfile,block=block)[0]
+                times.append((time.time()-t0)/n_steps)
+            outfile = os.path.join(directory, 'resumed.npy')
+            np.random.seed(0)
+            try:
+                mc.McMC(Const[0],X,m.LyModel,ModelType,Par,Const,step,n_steps,lnprior=interrupt,outfile=outfile,block=block)
+            except KeyboardInterrupt:
+                pass
+            np.random.seed(1)
+            resumed = mc.McMC(Const[0],X,m.LyModel,ModelType,Par,Const,step,n_steps,outfile=outfile,block=block)[0]
+            same    = np.array_equal(np.array(chain), np.array(resumed))
+        finally:
+            shutil.rmtree(directory)
+    print("McMC step: in memory %.3f ms, streamed %.3f ms; %d of %d rows held in memory; resumed chain identical: %s"
+          % (1e3*times[0], 1e3*times[1], block, n_steps, same))
+
+def runner(n_chains=4, n_steps=2000):
+    '''
+    src.runner.Runner against the same chains run one after another in
+    this process: wall times, and whether the chains are identical for 1
+    and 2 worker processes and to the serial runs with the same seeds.
+    '''
+    from src.mcmc import MCMC
+    from src.runner import Runner
+    mc          = MCMC()
+    ModelType   = 5
+    Par, Const, F, E, X = fixture(ModelType)
+    step        = 1e-3*np.abs(Par)
+
+    with quiet():
+        t0          = time.time()
+        serial      = []
+        for i in range(n_chains):
+            np.random.seed([0, i])
+            serial.append(mc.McMC(Const[0],X,m.LyModel,ModelType,Par,Const,step,n_steps)[0])
+        t_serial    = time.time()-t0
+        results     = {}
+        for n_processes in [1,2]:
+            t0      = time.time()
+            results[n_processes] = Runner(n_processes).run(X,ModelType,Par,Const,step,n_steps,n_chains)[0], time.time()-t0
+
+    print("%d chains of %d steps: serial %5.2f s, Runner 1 process %5.2f s, 2 processes %5.2f s (%d CPUs)"
+          % (n_chains, n_steps, t_serial, results[1][1], results[2][1], multiprocessing.cpu_count()))
+    print("Chains identical for 1 and 2 processes: %s, to the serial runs: %s"
+          % (np.array_equal(results[1][0], results[2][0]), np.array_equal(results[1][0], np.array(serial).transpose(1,0,2))))
+
+def metropolis(Par, Const, ModelType, F, E, n, seed=0, prior=0.1):
+    '''
+    A quiet Metropolis sampler for the benchmarks. The likelihood is
+    multiplied by a Gaussian prior of relative width prior around Par,
+    which keeps the nearly degenerate stellar parameters (max_f, uf, av)
+    bounded, and proposals are drawn from the resulting Fisher matrix.
+    Returns the chain.
+    '''
+    J       = m.LyJacobian(Par,Const,ModelType)*Par/E[:,None]
+    # Proposals in units of Par, where the covariance is well scaled
+    cov     = np.linalg.inv(J.T.dot(J) + np.eye(len(Par))/prior**2)*2.38**2/len(Par)
+    rng     = np.random.RandomState(seed)
+    jumps   = rng.multivariate_normal(np.zeros(len(Par)), 0.5*(cov+cov.T), n)*Par
+    u       = rng.uniform(0.,1.,n)
+    chi2    = lambda P: np.sum(((F-m.LyLikelihoodModel(P,Const,ModelType))/E)**2) + np.sum(((P-Par)/(prior*Par))**2)
+
+    P, c    = Par, chi2(Par)
+    chain   = np.empty((n,len(Par)))
+    for i in range(n):
+        c_new = chi2(P+jumps[i])
+        if u[i] < np.exp(-(c_new-c)/2.):
+            P, c = P+jumps[i], c_new
+        chain[i] = P
+    return chain
+
+def single(ModelType=2, n=5000):
+    '''
+    Model.dtype = np.float32 against double precision: model difference,
+    timings, and the shift of the posterior medians of a Metropolis run on
+    noiseless synthetic data in units of the posterior standard deviation.
+    The shift between two double precision runs with different seeds is
+    shown as the Monte Carlo noise for comparison.
+    '''
+    Par, Const, F, E, X = fixture(ModelType, seed=None)
+    Ps          = Par*(1. + 1e-3*np.random.RandomState(0).normal(0.,1.,(32,len(Par))))
+
+    results = {}
+    for dtype in [np.float64, np.float32]:
+        Model.dtype = dtype
+        t   = timeit(lambda: m.LyLikelihoodModel(Par,Const,ModelType), 50)
+        t_b = timeit(lambda: m.LyModelBatch(Ps,Const,ModelType,components=False), 10)
+        results[dtype] = m.LyLikelihoodModel(Par,Const,ModelType), metropolis(Par,Const,ModelType,F,E,n)[n//5:]
+        print("LyLikelihoodModel %-7s:\t%6.3f ms, 32 sets %6.2f ms" % (np.dtype(dtype).name, 1e3*t, 1e3*t_b))
+    Model.dtype = np.float64
+
+    (F64, chain64), (F32, chain32) = results[np.float64], results[np.float32]
+    chain_seed  = metropolis(Par,Const,ModelType,F,E,n,seed=1)[n//5:]
+    sigma       = np.std(chain64,axis=0)
+    shift       = np.abs(np.median(chain32,axis=0)-np.median(chain64,axis=0))/sigma
+    noise       = np.abs(np.median(chain_seed,axis=0)-np.median(chain64,axis=0))/sigma
+    print("float32 model difference %.1e of peak" % (np.abs(F32-F64).max()/F64.max()))
+    print("Posterior median shifts [sigma]: float32 %s, other seed %s"
+          % (' '.join('%.1e' % x for x in shift), ' '.join('%.1e' % x for x in noise)))
+
+def main():
+    absorption()
+    for ModelType in range(1,9):
+        Par, Const  = setup(ModelType)
+        t   = timeit(lambda: m.LyModel(Par,Const,ModelType), 50)
+        t_L = timeit(lambda: m.LyLikelihoodModel(Par,Const,ModelType), 50)
+        print("LyModel ModelType %d:\t%8.3f ms (likelihood only %8.3f ms)" % (ModelType, 1e3*t, 1e3*t_L))
+    batch()
+    voigt()
+    jacobian()
+    jacobian_zero()
+    emulator()
+    lines()
+    grid()
+    operator()
+    workspace()
+    single()
+    kernels()
+    threads()
+    sparse_tau()
+    clouds()
+    lsf_table()
+    ensemble()
+    runner()
+    adaptive()
+    convergence()
+    writer()
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['steps']:
+        steps(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,51 @@
+import numpy as np
+import zlib
+from collections import OrderedDict
+
+def fingerprint(*args):
+    '''
+    Returns a hashable key for a mix of arrays and scalars. Arrays are
+    keyed on their shape, dtype and a CRC32 checksum of their contents, so
+    that two grids with the same values give the same key.
+    '''
+    key = []
+    for a in args:
+        if isinstance(a, (np.ndarray, list, tuple)):
+            a = np.ascontiguousarray(a)
+            key.append((a.shape, a.dtype.str, zlib.crc32(a) & 0xffffffff))
+        else:
+            key.append(a)
+    return tuple(key)
+
+class LRUCache:
+    '''
+    A dictionary holding at most "size" items. When full, the least
+    recently used item is evicted.
+    '''
+
+    def __init__(self, size):
+        self.size   = size
+        self.items  = OrderedDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        if key not in self.items:
+            return default
+        value = self.items.pop(key)
+        self.items[key] = value
+        return value
+
+    def put(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        while len(self.items) > self.size:
+            self.items.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.items.clear()
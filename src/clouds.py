@@ -0,0 +1,42 @@
+class Clouds:
+    '''
+    A ModelType for Model.LyModel() and the other ModelType functions with
+    any number of absorbing clouds, each with velocity v, log column
+    density nh, turbulent velocity b and temperature T that are either free
+    or fixed, e.g.
+
+        ModelType = Clouds(['ism','bp','X','Y'],
+                           ['max_f','uf','av','nh_bp','v_bp','v_X','nh_X','v_Y','nh_Y'])
+
+    The free parameters (params) are ordered as given, the fixed ones
+    (Const) as in fixed below: the grid and LSF constants, the stellar
+    and cloud parameters that are not free, cloud by cloud, and the
+    continuum. With 'slope' among the free parameters the model is
+    multiplied by (W*slope + 1), as in ModelType 1.
+
+    The clouds with free parameters are evaluated together in one
+    Model.optical_depth() call on an (n_clouds, n_transitions, n_pix)
+    array, see Model.cloud_absorption().
+    '''
+
+    star_params     = ['max_f','uf','av']
+    cloud_params    = ['v','nh','b','T']
+
+    def __init__(self, clouds, free):
+        '''
+        clouds  => Names of the clouds, e.g. ['ism','bp','X']
+        free    => Names of the free parameters, from max_f, uf, av, slope
+                   and <param>_<cloud> for param in v, nh, b and T
+        '''
+        self.clouds = list(clouds)
+        self.free   = list(free)
+
+        params      = self.star_params + [n+'_'+c for c in self.clouds for n in self.cloud_params]
+        unknown     = [n for n in self.free if n not in params + ['slope']]
+        if unknown:
+            raise ValueError("Unknown free parameters %s for clouds %s" % (unknown, self.clouds))
+        self.fixed  = (['W','l','LyA','BetaPicRV','sigma_kernel','dp'] + [n for n in params if n not in self.free]
+                       + ['continuum_fit'])
+
+    def __repr__(self):
+        return 'Clouds(%r, %r)' % (self.clouds, self.free)
@@ -0,0 +1,253 @@
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+from scipy.special import ndtr
+
+class Convolution:
+    '''
+    Convolution of spectra with a fixed (line spread function) kernel.
+
+    The result is that of np.convolve(f,kernel,mode='same') for a kernel
+    whose element "origin" sits at zero lag, which allows the kernel to be
+    truncated without shifting it. Short kernels are applied directly,
+    long ones by overlap-add FFT convolution. The kernel transform is
+    cached per FFT length, so repeated calls on the same grid only pay one
+    forward and one inverse FFT.
+    '''
+
+    # Longest kernel that is applied directly. The direct and overlap-add
+    # costs both grow linearly with len(f), and cross at about 150 pixels.
+    direct_max = 150
+
+    def __init__(self, kernel, origin=None):
+        '''
+        kernel => The kernel, sampled on the spectral grid
+        origin => Index of the kernel element at zero lag, by default the
+                  one used by np.convolve(mode='same')
+        '''
+        self.kernel     = np.asarray(kernel, dtype=float)
+        self.origin     = (len(self.kernel)-1)//2 if origin is None else int(origin)
+        self.transforms = {}
+
+        if not 0 <= self.origin < len(self.kernel):
+            raise ValueError("origin must index the kernel (0 <= %d < %d)" % (self.origin, len(self.kernel)))
+
+    def __call__(self, f):
+        '''
+        Convolves f, a spectrum or an (..., n_pix) array of spectra, along
+        its last axis.
+        '''
+        f = np.asarray(f)
+        if len(self.kernel) <= self.direct_max:
+            return self.direct(f)
+        return self.fft(f)
+
+    def direct(self, f):
+        '''
+        Direct convolution of all the spectra in one np.convolve call: the
+        rows are concatenated with len(kernel)-1 zeros after each, so that
+        no row reaches into the next.
+        '''
+        n       = f.shape[-1]
+        rows    = f.reshape(-1, n)
+        P       = n + len(self.kernel) - 1
+        x       = np.zeros((len(rows), P))
+        x[:,:n] = rows
+        out     = np.convolve(x.ravel(),self.kernel,mode='full')[:x.size].reshape(x.shape)
+        return out[:,self.origin:self.origin+n].reshape(f.shape)
+
+    def sparse(self, n):
+        '''
+        The convolution of spectra of length n as a sparse banded (n, n)
+        matrix: element k of the kernel lies on diagonal origin - k.
+        '''
+        k       = np.arange(len(self.kernel))
+        keep    = np.abs(self.origin-k) < n
+        return diags([np.full(n-abs(self.origin-i), self.kernel[i]) for i in k[keep]], self.origin-k[keep], shape=(n, n), format='csr')
+
+    def transform(self, nfft):
+        ''' Returns the (cached) rfft of the kernel zero padded to nfft. '''
+        if nfft not in self.transforms:
+            self.transforms[nfft] = np.fft.rfft(self.kernel, nfft)
+        return self.transforms[nfft]
+
+    def fft(self, f):
+        '''
+        Overlap-add convolution. f is cut into blocks of length B which are
+        all transformed in one rfft call, multiplied with the kernel
+        transform and inverted in one irfft call. Every output block then
+        receives its own block and the tail of the previous one.
+        '''
+        n       = f.shape[-1]
+        k       = len(self.kernel)
+        nfft    = 2**int(np.ceil(np.log2(max(4*k, 64))))
+        B       = nfft - (k-1)                          # Block length, >= k-1
+        n_blk   = -(-n//B)                              # ceil(n/B)
+
+        x       = np.zeros(f.shape[:-1]+(n_blk*B,))
+        x[...,:n] = f
+        x       = x.reshape(f.shape[:-1]+(n_blk,B))
+        y       = np.fft.irfft(np.fft.rfft(x,nfft,axis=-1)*self.transform(nfft),nfft,axis=-1)
+
+        full    = np.zeros(f.shape[:-1]+(n_blk+1,B))
+        full[...,:-1,:]     += y[...,:B]
+        full[...,1:,:k-1]   += y[...,B:]
+        full    = full.reshape(f.shape[:-1]+(-1,))
+
+        return full[...,self.origin:self.origin+n]
+
+class GridConvolution:
+    '''
+    Convolution with a Gaussian LSF on a non-uniform grid l.
+
+    The spectrum is taken to be linear between the points of l, as for
+    np.interp, and zero beyond its ends, as for np.convolve with
+    mode='same'. The Gaussian is integrated exactly against each linear
+    piece, so row i of the sparse (len(l), len(l)) matrix holds the
+    integral of K(l_i + offset - x) times the hat function of l_j, for all
+    l_j within n_sigma standard deviations of l_i + offset.
+    '''
+
+    def __init__(self, l, sigma, n_sigma=None, offset=0.):
+        '''
+        l       => The (increasing) grid of the spectra
+        sigma   => Standard deviation of the LSF, in units of l
+        n_sigma => Truncation of the LSF in standard deviations, or None
+        offset  => Position of the LSF centre relative to the output point
+        '''
+        l       = np.asarray(l, dtype=float)
+        n       = len(l)
+        reach   = np.inf if n_sigma is None else n_sigma*sigma
+        centre  = l + offset
+
+        lo      = np.maximum(np.searchsorted(l, centre-reach, side='left')-1, 0)
+        hi      = np.minimum(np.searchsorted(l, centre+reach, side='right')+1, n)
+        rows    = np.repeat(np.arange(n), hi-lo)
+        cols    = np.arange(len(rows)) - np.repeat(np.cumsum(hi-lo)-(hi-lo)-lo, hi-lo)
+
+        # Rising half of the hat function on [l_j-1, l_j], falling half on
+        # [l_j, l_j+1].
+        c       = centre[rows]
+        x0, x1  = l[np.maximum(cols-1, 0)], l[cols]
+        values  = np.where(cols > 0, self.ramp(c, x0, x1, sigma, rising=True), 0.)
+        x0, x1  = l[cols], l[np.minimum(cols+1, n-1)]
+        values += np.where(cols < n-1, self.ramp(c, x0, x1, sigma, rising=False), 0.)
+
+        self.l          = l
+        self.sigma      = sigma
+        self.offset     = offset
+        self.matrix     = csr_matrix((values, (rows, cols)), shape=(n, n))
+
+    def sparse(self, n):
+        ''' The convolution as a sparse (n, n) matrix, n = len(l). '''
+        if n != len(self.l):
+            raise ValueError("GridConvolution is defined on %d points, not %d" % (len(self.l), n))
+        return self.matrix
+
+    def ramp(self, c, x0, x1, sigma, rising):
+        '''
+        Integral over [x0, x1] of a unit Gaussian of standard deviation
+        sigma centred on c, times the linear function rising from 0 at x0
+        to 1 at x1 (or falling from 1 to 0).
+        '''
+        width   = np.where(x1 > x0, x1-x0, 1.)
+        t0, t1  = (x0-c)/sigma, (x1-c)/sigma
+        mass    = ndtr(t1) - ndtr(t0)
+        up      = (sigma*(np.exp(-0.5*t0**2)-np.exp(-0.5*t1**2))/np.sqrt(2.*np.pi) + (c-x0)*mass)/width
+        return up if rising else mass - up
+
+    def __call__(self, f):
+        '''
+        Convolves f, a spectrum or an (..., len(l)) array of spectra, along
+        its last axis.
+        '''
+        f       = np.asarray(f)
+        n       = f.shape[-1]
+        return self.matrix.dot(f.reshape(-1, n).T).T.reshape(f.shape)
+
+class TabulatedConvolution(GridConvolution):
+    '''
+    Convolution with a wavelength dependent, tabulated LSF (src.lsf.LSFTable)
+    on a grid l. Row i of the sparse matrix holds the LSF at l_i, centred
+    on l_i + offset, integrated against the hat function of each l_j
+    within the reach of the table. On a uniform grid this is the
+    trapezoidal rule, i.e. the LSF sampled on l as in K(); on a non-uniform
+    grid each linear piece is integrated with n_quad point Gauss-Legendre
+    quadrature. As for GridConvolution the spectrum is zero beyond the
+    ends of l.
+    '''
+
+    n_quad = 3
+
+    def __init__(self, l, table, offset=0.):
+        '''
+        l       => The (increasing) grid of the spectra
+        table   => LSFTable, in units of l
+        offset  => Position of the LSF centre relative to the output point
+        '''
+        l       = np.asarray(l, dtype=float)
+        n       = len(l)
+        reach   = table.reach()
+        centre  = l + offset
+
+        lo      = np.maximum(np.searchsorted(l, centre-reach, side='left')-1, 0)
+        hi      = np.minimum(np.searchsorted(l, centre+reach, side='right')+1, n)
+        rows    = np.repeat(np.arange(n), hi-lo)
+        cols    = np.arange(len(rows)) - np.repeat(np.cumsum(hi-lo)-(hi-lo)-lo, hi-lo)
+        w, c    = l[rows], centre[rows]
+
+        dl      = np.diff(l)
+        if np.ptp(dl) <= 1e-6*np.abs(np.mean(dl)):
+            width   = 0.5*(l[np.minimum(cols+1, n-1)] - l[np.maximum(cols-1, 0)])
+            values  = table(w, c-l[cols])*width
+        else:
+            # Rising half of the hat function on [l_j-1, l_j], falling half
+            # on [l_j, l_j+1]; the pieces beyond the ends have zero width.
+            nodes, weights = np.polynomial.legendre.leggauss(self.n_quad)
+            values  = 0.
+            for x0, x1, rising in [(l[np.maximum(cols-1, 0)], l[cols], True),
+                                   (l[cols], l[np.minimum(cols+1, n-1)], False)]:
+                for t, weight in zip(0.5*(nodes+1.), 0.5*weights):
+                    values = values + weight*(x1-x0)*(t if rising else 1.-t)*table(w, c-(x0+t*(x1-x0)))
+
+        self.l          = l
+        self.table      = table
+        self.offset     = offset
+        self.matrix     = csr_matrix((values, (rows, cols)), shape=(n, n))
+
+class LSFOperator:
+    '''
+    LSF convolution on the model grid l followed by linear interpolation
+    onto the COS wavelengths W, fused into one sparse (len(W), len(l))
+    matrix. Both steps are linear and fixed for a run, so the operator is
+    built once and a model spectrum, or an (..., len(l)) array of them,
+    costs a single sparse product.
+    '''
+
+    def __init__(self, W, l, engine, dtype=np.float64):
+        '''
+        W       => Output wavelengths
+        l       => Model grid
+        engine  => Convolution, GridConvolution or TabulatedConvolution of
+                   the LSF on l
+        dtype   => Floating point type of the matrix
+        '''
+        W, l    = np.asarray(W, dtype=float), np.asarray(l, dtype=float)
+        n, m    = len(W), len(l)
+
+        # Interpolation weights as in np.interp(W,l,f)
+        i       = np.clip(np.searchsorted(l,W)-1,0,m-2)
+        t       = np.clip((W-l[i])/(l[i+1]-l[i]),0.,1.)
+        rows    = np.concatenate((np.arange(n), np.arange(n)))
+        interp  = csr_matrix((np.concatenate((1.-t, t)), (rows, np.concatenate((i, i+1)))), shape=(n, m))
+
+        self.shape  = (n, m)
+        self.matrix = interp.dot(engine.sparse(m)).tocsr().astype(dtype)
+
+    def __call__(self, f):
+        '''
+        Applies the operator to f, a spectrum or an (..., len(l)) array of
+        spectra, along its last axis.
+        '''
+        f       = np.asarray(f)
+        m       = f.shape[-1]
+        return self.matrix.dot(f.reshape(-1, m).T).T.reshape(f.shape[:-1]+(self.shape[0],))
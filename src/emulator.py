@@ -0,0 +1,136 @@
+import numpy as np
+
+from src.model import Model
+
+m   = Model()
+
+class Emulator:
+    '''
+    Precomputed H I + D I Ly-alpha absorption for exploratory fits and grid
+    scans.
+
+    In Model.optical_depth() the optical depth of a transition is
+    N/b_wid * F(b_wid, u), where N is the column density, b_wid the line
+    width of Model.doppler_width() and u = y/(beta*b_wid) the offset
+    y = |w/xc - 1| from the line centre in Doppler units. The velocity and
+    column density therefore enter exactly, and only F is tabulated,
+    on a grid uniform in log b_wid and in s = u/(u+u_scale), which is fine
+    in the line core and coarse in the wings and costs a single division
+    to evaluate. F depends on b_wid only through the damping parameter, so
+    the table is smooth in log b_wid. Queries interpolate the table
+    bilinearly. Beyond u_max the Lorentzian wing (F ~ u^-2, to a relative
+    1.5/u_max^2) is extrapolated.
+
+    accuracy() gives the transmission error against Model.absorption(),
+    which with the default grid is below 1e-4 for 14 <= log N <= 21,
+    3 <= b_wid <= 150 and |v| <= 200 km/s; benchmark.emulator() reports it.
+    '''
+
+    # optical_depth(): u = 1e4*y/b with b = 4.30136955e-3*b_wid
+    beta    = 4.30136955e-7
+
+    def __init__(self, b_range=(1., 300.), n_b=256, u_max=300., u_scale=5., n_u=8001):
+        '''
+        b_range => Range of the line width b_wid of Model.doppler_width()
+        n_b     => Number of grid points in log b_wid
+        u_max   => Largest tabulated offset in Doppler units
+        u_scale => Offset at which the grid changes from fine to coarse
+        n_u     => Number of grid points in u/(u+u_scale)
+        '''
+        self.logb   = np.linspace(np.log(b_range[0]), np.log(b_range[1]), n_b)
+        self.s      = np.linspace(0., u_max/(u_max+u_scale), n_u)
+        self.u_max  = u_max
+        self.u_scale = u_scale
+        self.LyA    = None
+        self.table  = None
+
+    def build(self, LyA):
+        '''
+        Tabulates F of the [Hydrogen, Deuterium] transitions for the
+        Ly-alpha wavelength LyA using Model.optical_depth().
+        '''
+        w, mass, fosc, delta, abund = m.transitions(LyA)
+        u       = self.u_scale*self.s/(1.-self.s)
+        b_wid   = np.exp(self.logb)
+        table   = np.empty((len(w), len(b_wid), len(u)), dtype=np.float32)
+        for i in range(len(w)):
+            # A unit column density at rest, with T chosen to give b_wid
+            l           = w[i,0]/(1.+self.beta*b_wid[:,None,None]*u)
+            hav         = m.optical_depth(l, 0., 0., 0., mass[i,0]*b_wid**2, LyA)
+            table[i]    = hav[:,i,:]*b_wid[:,None]/abund[i,0]
+        self.LyA, self.table = LyA, table
+        return table
+
+    def save(self, filename):
+        ''' Writes the table to a compressed .npz file. '''
+        np.savez_compressed(filename, LyA=self.LyA, logb=self.logb, s=self.s, u_max=self.u_max, u_scale=self.u_scale, table=self.table)
+
+    def load(self, filename):
+        ''' Reads a table written by save(). '''
+        d = np.load(filename)
+        self.LyA, self.logb, self.s, self.table = float(d['LyA']), d['logb'], d['s'], d['table']
+        self.u_max, self.u_scale    = float(d['u_max']), float(d['u_scale'])
+        return self
+
+    def F(self, i, b_wid, u):
+        '''
+        Interpolated F of transition i. For a single b_wid the two
+        bracketing rows are blended once and interpolated along u only.
+        '''
+        logb    = np.log(b_wid)
+        if np.any(logb < self.logb[0]) or np.any(logb > self.logb[-1]):
+            raise ValueError("b_wid outside the emulator grid (%.3g - %.3g)" % (np.exp(self.logb[0]), np.exp(self.logb[-1])))
+
+        x       = (logb - self.logb[0])/(self.logb[1]-self.logb[0])
+        j       = np.minimum(x.astype(int), len(self.logb)-2)
+        x       = x-j
+        u_c     = np.minimum(u, self.u_max)
+        z       = u_c/(u_c+self.u_scale)/(self.s[1]-self.s[0])
+        k       = np.minimum(z.astype(int), len(self.s)-2)
+        z       = z-k
+        t       = self.table[i]
+        if np.size(b_wid) == 1:
+            row     = (1.-float(x))*t[int(j)] + float(x)*t[int(j)+1]
+            out     = row[k] + z*(row[k+1]-row[k])
+        else:
+            out     = (1.-x)*((1.-z)*t[j,k] + z*t[j,k+1]) + x*((1.-z)*t[j+1,k] + z*t[j+1,k+1])
+
+        # Lorentzian wings beyond the table
+        return out*(self.u_max/np.maximum(u, self.u_max))**2
+
+    def absorption(self, l,v_bp,nh,vturb,T,LyA):
+        '''
+        Emulated Model.absorption(). v_bp, nh, vturb and T may be arrays of
+        shape (n_sets,), in which case the transmission is returned with
+        shape (n_sets, len(l)).
+        '''
+        if self.table is None:
+            self.build(LyA)
+        if LyA != self.LyA:
+            raise ValueError("Emulator was built for LyA = %r, not %r" % (self.LyA, LyA))
+
+        v_bp, nh, vturb, T = [np.asarray(x, dtype=float)[...,None] for x in (v_bp, nh, vturb, T)]
+        w, mass, fosc, delta, abund = m.transitions(LyA)
+
+        # The transitions are summed before the exponential. Where their sum
+        # is >= 20 but each is < 20 this returns 0 instead of < 2e-9.
+        hav     = 0.
+        for i in range(len(w)):
+            b_wid   = m.doppler_width(vturb, T, mass[i,0])
+            u       = np.abs(w[i,0]*(1.+v_bp*1.e9/m.c_light)/l - 1.)/(self.beta*b_wid)
+            hav     = hav + abund[i,0]*10**nh/b_wid*self.F(i, b_wid, u)
+        return np.where(hav < 20., np.exp(-np.minimum(hav, 20.)), 0.)
+
+    def accuracy(self, l, LyA, n=200, nh_range=(14., 21.), b_range=(3., 150.), v_range=(-200., 200.), seed=0):
+        '''
+        Compares absorption() with Model.absorption() for n random
+        absorbers with column density, line width (as T with vturb = 0) and
+        velocity drawn uniformly from the given ranges. Returns the largest
+        and the mean absolute transmission error.
+        '''
+        rng     = np.random.RandomState(seed)
+        nh      = rng.uniform(nh_range[0], nh_range[1], n)
+        T       = np.exp(rng.uniform(np.log(b_range[0]), np.log(b_range[1]), n))**2
+        v       = rng.uniform(v_range[0], v_range[1], n)
+        err     = np.abs(self.absorption(l, v, nh, 0., T, LyA) - m.absorption(l, v, nh, 0., T, LyA))
+        return err.max(), err.mean()
@@ -0,0 +1,74 @@
+import math
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+from src.voigt import Voigt
+
+# True if the kernels below are compiled. Without numba they are plain
+# Python loops, which agree with the compiled ones but are far too slow
+# for fitting; Model then keeps its NumPy path (see Model.jit).
+available = njit is not None
+
+def compiled(f):
+    ''' Compiles f with numba when it is installed, else returns f. '''
+    return njit(cache=True, nogil=True)(f) if available else f
+
+# Voigt.humlicek(): Weideman (1994) with N=32 near the line centre and the
+# asymptotic expansion for |u|+a >= 10. scipy's wofz() cannot be called
+# from compiled code.
+weideman_coeffs = Voigt().weideman_coeffs
+L               = Voigt.L
+sqrt_pi         = math.sqrt(math.pi)
+
+@compiled
+def voigt(a, u):
+    ''' H(a,u) of Voigt.humlicek() for a single point. '''
+    z   = complex(u, a)
+    if abs(u) + a >= 10.:
+        iz2 = 1./(z*z)
+        return (1j/(sqrt_pi*z)*(1. + iz2*(0.5 + iz2*(0.75 + iz2*(1.875 + iz2*6.5625))))).real
+
+    Lz  = L - 1j*z
+    Z   = (L + 1j*z)/Lz
+    p   = 0j
+    for k in range(len(weideman_coeffs)):
+        p = p*Z + weideman_coeffs[k]
+    return (2.*p/(Lz*Lz) + 1./(sqrt_pi*Lz)).real
+
+@compiled
+def emission(l, lambda1, lambda2, max_f, uf, av, continuum, out):
+    '''
+    Model.emission() for one parameter set, into out: the double Voigt
+    profile centred on lambda1 and lambda2 plus the continuum, in a single
+    pass over l.
+    '''
+    for i in range(len(l)):
+        out[i] = max_f*(voigt(av, uf*(l[i]-lambda1)) + voigt(av, uf*(l[i]-lambda2))) + continuum[i]
+    return out
+
+@compiled
+def absorption(l, v_bp, c, N_col, b_wid, w, fosc, delta, out):
+    '''
+    Model.absorption() for one parameter set, into out: the product of
+    the transmissions of the lines w with column densities N_col and line
+    widths b_wid (arrays of shape (n_lines,)), evaluated pixel by pixel
+    without optical depth arrays. Optical depths of 20 or more are fully
+    absorbed.
+    '''
+    shift   = 1.+v_bp*1.e9/c
+    for i in range(len(l)):
+        t       = 1.
+        cx      = c*shift/l[i]
+        for j in range(len(w)):
+            dnud    = 4.30136955e-3*b_wid[j]*c/w[j]
+            tau     = 1.16117705e-14*N_col[j]*w[j]*fosc[j]/b_wid[j]*voigt(delta[j]/dnud, 1.e4*abs((cx-c/w[j])/dnud))
+            if tau >= 20.:
+                t   = 0.
+                break
+            t      *= math.exp(-tau)
+        out[i] = t
+    return out
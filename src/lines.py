@@ -0,0 +1,101 @@
+import numpy as np
+
+class LineList:
+    '''
+    Atomic data of the FUV absorption lines covered by the COS G130M
+    spectra, sorted by wavelength.
+
+    Atomic data after Morton (2003, ApJS 149, 205). H I and D I have the
+    values used by Model.absorption() since the original Ly-alpha fits.
+    '''
+
+    # species, rest wavelength [Ang], oscillator strength, damping constant
+    # Gamma [s^-1], mass [amu]
+    data = [
+        ('NI',      1134.1653,  0.0134, 1.48e8, 14.),
+        ('NI',      1134.4149,  0.0268, 1.48e8, 14.),
+        ('NI',      1134.9803,  0.0402, 1.48e8, 14.),
+        ('SiII',    1190.4158,  0.292,  6.53e8, 28.),
+        ('SiII',    1193.2897,  0.582,  2.69e9, 28.),
+        ('NI',      1199.5496,  0.132,  4.07e8, 14.),
+        ('NI',      1200.2233,  0.0869, 4.02e8, 14.),
+        ('NI',      1200.7098,  0.0432, 3.99e8, 14.),
+        ('SiIII',   1206.4995,  1.63,   2.48e9, 28.),
+        ('DI',      1215.3394,  0.416,  6.27e8, 2.),
+        ('HI',      1215.6702,  0.416,  6.27e8, 1.),
+        ('SiII',    1260.4221,  1.18,   2.95e9, 28.),
+        ('OI',      1302.1685,  0.0520, 5.65e8, 16.),
+        ('SiII',    1304.3702,  0.0863, 1.01e9, 28.),
+        ('CII',     1334.5323,  0.128,  2.88e8, 12.),
+        ('CII*',    1335.6627,  0.0128, 2.88e8, 12.),
+        ('CII*',    1335.7077,  0.115,  2.88e8, 12.),
+    ]
+
+    # Lines are evaluated outside a model window as far as their Lorentzian
+    # damping wings reach an optical depth of tau_wing, or of the tau_min
+    # passed to reach(), see reach(), and at least margin [Ang] for their
+    # Doppler cores at any cloud velocity.
+    margin      = 5.
+    tau_wing    = 1e-6
+
+    # pi e^2/(m_e c) [cm^2 Hz] and c [cm/s]
+    sigma_0     = 0.026540
+    c_light     = 2.99792458e10
+
+    def __init__(self, data=None):
+        '''
+        data => List of (species, wavelength, fosc, Gamma, mass) tuples, by
+                default LineList.data
+        '''
+        data    = sorted(self.data if data is None else data, key=lambda line: line[1])
+        self.species    = np.array([line[0] for line in data])
+        self.w          = np.array([line[1] for line in data], dtype=float)
+        self.fosc       = np.array([line[2] for line in data], dtype=float)
+        self.gamma      = np.array([line[3] for line in data], dtype=float)
+        self.mass       = np.array([line[4] for line in data], dtype=float)
+
+    def __len__(self):
+        return len(self.w)
+
+    def reach(self, logN, tau_min=0.):
+        '''
+        Distance [Ang] from the centre of each line out to which it has an
+        optical depth of max(tau_min, tau_wing), for the log column densities
+        logN = {species: log N}, at least margin. The damping wing of a line
+        of wavelength w has the optical depth
+
+            tau = N f sigma_0 (Gamma/4 pi) w^4 / (pi c^2 dw^2)
+
+        at dw from its centre, e.g. 5e-3 at 6 Ang for H I with log N = 18.6,
+        so its reach is 410 Ang at tau = 1e-6. Lines of species not in logN
+        have reach margin.
+        '''
+        N       = np.array([10**logN[sp] if sp in logN else 0. for sp in self.species])
+        w       = 1e-8*self.w
+        wing    = N*self.fosc*self.sigma_0*self.gamma*w**4/(4.*np.pi**2*self.c_light**2)
+        return np.maximum(1e8*np.sqrt(wing/max(tau_min, self.tau_wing)), self.margin)
+
+    def window(self, l_min, l_max, margin=None):
+        '''
+        Returns the indices of the lines with rest wavelengths within margin
+        of [l_min, l_max]. margin is a number or an array with one value per
+        line, e.g. from reach(), and by default LineList.margin.
+        '''
+        margin  = self.margin if margin is None else margin
+        return np.flatnonzero((self.w >= l_min-margin) & (self.w <= l_max+margin))
+
+    def find(self, species, w):
+        ''' Index of the line of species closest to the wavelength w. '''
+        idx     = np.flatnonzero(self.species == species)
+        if len(idx) == 0:
+            raise ValueError("No lines of '%s' in the line list" % species)
+        return idx[np.argmin(np.abs(self.w[idx]-w))]
+
+    def columns(self, idx):
+        '''
+        Wavelength, mass, oscillator strength and damping constant
+        Gamma/(4 pi) of the lines idx, as column vectors in the layout of
+        Model.transitions().
+        '''
+        return (self.w[idx][:,None], self.mass[idx][:,None], self.fosc[idx][:,None],
+                self.gamma[idx][:,None]/(4.*np.pi))
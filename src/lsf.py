@@ -0,0 +1,91 @@
+import numpy as np
+from scipy.interpolate import CubicSpline
+
+from src.cache import fingerprint
+
+class LSFTable:
+    '''
+    Tabulated, wavelength dependent line spread function, e.g. the COS
+    G130M LSFs published by STScI, as used by Model.lsf() when set as
+    Model.lsf_table.
+
+    The profiles are given at a few wavelengths on a grid of pixel offsets
+    centred on the middle element. Between the tabulated wavelengths the
+    profiles are interpolated linearly. Along the offsets they are
+    resampled oversample times finer with a cubic spline when the table
+    is set, and interpolated linearly on that grid, as a Gaussian of 6.5
+    pixels FWHM sampled once per pixel and interpolated linearly is off by
+    0.4% of the model peak. Beyond the outer offsets the LSF is zero. Every
+    profile is normalised to unit sum, so the interpolated LSF conserves
+    flux.
+    '''
+
+    oversample = 8
+
+    def __init__(self, wavelengths=None, profiles=None, dispersion=0.00997):
+        '''
+        wavelengths => Wavelengths of the profiles [Ang], increasing
+        profiles    => (len(wavelengths), n_offsets) array, row i the LSF at
+                       wavelengths[i] on pixel offsets -(n_offsets-1)/2 ..
+                       (n_offsets-1)/2
+        dispersion  => Pixel size [Ang], 0.00997 for COS G130M
+        '''
+        self.dispersion = dispersion
+        if wavelengths is not None:
+            self.set(wavelengths, profiles)
+
+    def set(self, wavelengths, profiles):
+        ''' Stores normalised copies of the profiles. '''
+        wavelengths = np.atleast_1d(np.asarray(wavelengths, dtype=float))
+        profiles    = np.atleast_2d(np.asarray(profiles, dtype=float))
+        if profiles.shape[0] != len(wavelengths) or profiles.shape[1] % 2 == 0:
+            raise ValueError("Expected an odd number of offsets for each of %d wavelengths, got profiles of shape %s"
+                             % (len(wavelengths), profiles.shape))
+        if np.any(np.diff(wavelengths) <= 0):
+            raise ValueError("LSF wavelengths must be increasing")
+
+        self.wavelengths    = wavelengths
+        self.profiles       = profiles/profiles.sum(axis=1)[:,None]
+        self.half_width     = (profiles.shape[1]-1)//2
+        self.key            = fingerprint(self.wavelengths, self.profiles, float(self.dispersion), self.oversample)
+
+        # Zero padded by one pixel, so that the LSF falls to zero linearly
+        x           = np.arange(-self.half_width-1, self.half_width+2)
+        fine        = np.linspace(x[0], x[-1], self.oversample*(len(x)-1)+1)
+        table       = np.pad(self.profiles, ((0,0),(1,1)), 'constant')
+        self.fine   = np.maximum(CubicSpline(x, table, axis=1)(fine), 0.)
+        self.fine  /= self.fine.sum(axis=1)[:,None]/self.oversample
+        return self
+
+    def load(self, filename):
+        '''
+        Reads an STScI COS LSF table: the first row holds the wavelengths,
+        each following row the LSF values at one pixel offset, one column
+        per wavelength.
+        '''
+        data    = np.loadtxt(filename)
+        return self.set(data[0], data[1:].T)
+
+    def reach(self):
+        ''' Largest offset [Ang] at which the LSF is non-zero. '''
+        return (self.half_width+1)*self.dispersion
+
+    def __call__(self, w, dx):
+        '''
+        LSF per Angstrom at wavelengths w and offsets dx [Ang], which
+        broadcast against each other. Wavelengths outside the table take
+        the nearest profile.
+        '''
+        n_w     = len(self.wavelengths)
+        x       = np.interp(w, self.wavelengths, np.arange(n_w))
+        i       = np.minimum(x.astype(int), max(n_w-2, 0))
+        x       = x-i
+
+        # Offsets in fine steps from the first element of the padded rows
+        table   = self.fine
+        y       = np.clip((dx/self.dispersion + self.half_width + 1.)*self.oversample, 0., table.shape[1]-1.)
+        k       = np.minimum(y.astype(int), table.shape[1]-2)
+        y       = y-k
+
+        row     = lambda j: (1.-y)*table[j,k] + y*table[j,k+1]
+        return ((1.-x)*row(i) + x*row(np.minimum(i+1, n_w-1)))/self.dispersion
@@ -2,6 +2,7 @@ import numpy as np
 
 from src.statistics import Stats
 from src.model import Model
+from src.writer import ChainWriter
 
 s   = Stats()
 m   = Model()
@@ -39,7 +40,8 @@ class MCMC:
 
       return param_ans,param_u,param_l
 
-    def McMC(self, x, X, F, ModelType, P, Const, S, C):
+    def McMC(self, x, X, F, ModelType, P, Const, S, C, workspace=None, lnprior=None, adapt=0, outfile=None,
+             block=1000, resume=True):
       '''
       x => x-axis values (In this case wavelength)
       X => Data (y,yerr,model)
@@ -47,30 +49,386 @@ class MCMC:
       P => Parameters
       S => Scale
       C => Chain length
+      workspace => Optional src.workspace.Workspace(Const, ModelType), which
+                   evaluates the likelihood in preallocated buffers
+      lnprior   => Optional log prior of an (n, len(P)) array of parameters,
+                   returning n values; by default the prior is flat
+      adapt     => Number of burn-in steps over which the proposal adapts
+                   (Haario et al. 2001), after which it is frozen. The
+                   proposal covariance follows the covariance of the chain,
+                   in units of S, and its scale is tuned towards an
+                   acceptance rate of target_acceptance. With adapt=0 the
+                   proposal is the fixed Gaussian of widths S.
+      outfile   => Optional .npy file to which the chain is written every
+                   block steps with a src.writer.ChainWriter, together with
+                   a checkpoint of the sampler. If the checkpoint exists the
+                   run resumes from it, see ChainWriter for resume. The
+                   chain is then returned as a read-only memory map.
       '''
+      C         = int(C)
       L         = s.Merit(X)
+      if lnprior is not None:
+        L       = L*np.exp(lnprior(np.atleast_2d(P))[0])
+      proposal  = self.Proposal(P, S)
+      if outfile is None:
+        chain   = np.zeros(shape=(C,len(P)))
+        P, L, moves = self.Walk(X, ModelType, P, L, Const, S, chain, 0, proposal, adapt, workspace, lnprior)
+      else:
+        writer  = ChainWriter(outfile, C, len(P), block, resume)
+        i, state = writer.load()
+        moves   = 0
+        if state is not None:
+          P, L, moves = state['P'], float(state['L']), int(state['moves'])
+          np.random.set_state(('MT19937', state['rng_key'], int(state['rng_pos']), int(state['rng_gauss'][0]),
+                               float(state['rng_gauss'][1])))
+          for k in ['mean','cov','chol','scale']:
+            setattr(proposal, k, state['proposal_'+k])
+        rows    = np.zeros(shape=(writer.block,len(P)))
+        while i < C:
+          n     = min(writer.block, C-i)
+          P, L, moved = self.Walk(X, ModelType, P, L, Const, S, rows[:n], i, proposal, adapt, workspace, lnprior, C)
+          writer.write(i, rows[:n])
+          i    += n
+          moves+= moved
+          rng   = np.random.get_state()
+          writer.save(i, P=P, L=L, moves=moves, rng_key=rng[1], rng_pos=rng[2], rng_gauss=[rng[3], rng[4]],
+                      **dict(('proposal_'+k, getattr(proposal, k)) for k in ['mean','cov','chol','scale']))
+        chain   = writer.chain()
+      print "\nAccepted steps: ",round(100.*moves/len(chain),2),"%"
+
+      return chain, moves
+
+    def Likelihood(self, X, ModelType, P, Const, workspace=None, lnprior=None):
+      ''' Likelihood of the data X at P, times the prior, as in McMC(). '''
+      if workspace is None:
+        L       = s.Merit((X[0],X[1],m.LyLikelihoodModel(P, Const, ModelType)))
+      else:
+        L       = np.exp(-workspace.chi2(P, X[0], X[1])/2.)
+      if lnprior is not None:
+        L       = L*np.exp(lnprior(np.atleast_2d(P))[0])
+      return L
+
+    def Walk(self, X, ModelType, P, L, Const, S, chain, i0, proposal, adapt=0, workspace=None, lnprior=None, C=None):
+      '''
+      Metropolis steps i0 to i0+len(chain) of McMC(), of C steps, from P,
+      with likelihood L, into chain. Returns the last P and L and the number
+      of accepted steps.
+      '''
+      C         = C or len(chain)
       moves     = 0
-      chain     = np.zeros(shape=(C,len(P)))
-      L_chain   = np.zeros(shape=(C,1))
-      for i in range(int(C)):
+      for i in range(i0, i0+len(chain)):
         if i%100 == 0.:
-          print (i/C)*100.," % done"
-        jump        = np.random.normal(0.,1.,len(S)) * S
-        P           = P + jump
-        new_fit     = m.LyModel(P, Const, ModelType)[0]
-        X           = X[0],X[1],new_fit
-        L_new       = s.Merit(X)
-        L_chain[i]  = L_new
+          print (i/float(C))*100.," % done"
+        if adapt:
+          jump      = proposal.jump()
+        else:
+          jump      = np.random.normal(0.,1.,len(S)) * S
+        P_new       = P + jump
+        L_new       = self.Likelihood(X, ModelType, P_new, Const, workspace, lnprior)
         ratio       = L_new/L
 
+        # A rejected step keeps P exactly, which P_new - jump need not be
         if (np.random.random() > ratio):
-          P     = P - jump
           moved = 0
         else:
+          P     = P_new
           L     = L_new
           moved = 1
         moves  += moved
-        chain[i,:] = np.array(P)
-      print "\nAccepted steps: ",round(100.*(moves/C),2),"%"
-      
+        chain[i-i0,:] = np.array(P)
+        if i < adapt:
+          proposal.update(P, moved, i)
+
+      return P, L, moves
+
+    def McMCChains(self, x, X, F, ModelType, P, Const, S, C, n_chains=4, check=1000, r_hat=1.01, ess=400.,
+                   seed=None, workspace=None, lnprior=None, adapt=0, outfile=None, n_tau=50.):
+      '''
+      Runs n_chains McMC() chains side by side, all from P, and stops before
+      C steps once the chains have converged: every `check` steps the
+      Diagnostics() of the samples after the first half of each chain, and
+      after the adaptation window, are computed, and sampling stops when
+      every parameter has split-R_hat below r_hat and an effective sample
+      size above ess, and the window is at least n_tau autocorrelation
+      times long, so that tau itself is reliable.
+
+      x, X, F, ModelType, P, Const, S, C, workspace, lnprior and adapt as
+      for McMC(); chain j draws from a random stream seeded by (seed, j), as
+      in src.runner.Runner.
+
+      outfile   => Optional .npz file for the chains, their metadata and
+                   the final diagnostics, see Save()
+
+      Returns the chains with shape (n_steps, n_chains, len(P)), the number
+      of accepted steps of each chain and the final diagnostics.
+      '''
+      C         = int(C)
+      P         = np.asarray(P, dtype=float)
+      state     = np.random.get_state()
+      streams   = [np.random.RandomState(None if seed is None else [seed, j]).get_state() for j in range(n_chains)]
+      walkers   = [[P, self.Likelihood(X, ModelType, P, Const, workspace, lnprior), self.Proposal(P, S)]
+                   for j in range(n_chains)]
+      chain     = np.zeros(shape=(C,n_chains,len(P)))
+      moves     = np.zeros(n_chains, dtype=int)
+      n         = 0
+      while n < C:
+        n_next  = min(n+check, C)
+        for j in range(n_chains):
+          np.random.set_state(streams[j])
+          P_j, L_j, proposal = walkers[j]
+          P_j, L_j, moved = self.Walk(X, ModelType, P_j, L_j, Const, S, chain[n:n_next,j], n, proposal,
+                                      adapt, workspace, lnprior, C)
+          walkers[j]  = P_j, L_j, proposal
+          moves[j]   += moved
+          streams[j]  = np.random.get_state()
+        n       = n_next
+        diagnostics = self.Diagnostics(chain[max(n//2, min(adapt, n-4)):n])
+        print "\nStep",n,": max R_hat",np.max(diagnostics['r_hat']),", min ESS",np.min(diagnostics['ess'])
+        n_window = n - max(n//2, min(adapt, n-4))
+        if (n > adapt and np.all(diagnostics['r_hat'] < r_hat) and np.all(diagnostics['ess'] > ess)
+            and np.all(n_window >= n_tau*diagnostics['tau'])):
+          break
+      np.random.set_state(state)
+      chain     = chain[:n]
+      print "\nAccepted steps: ",round(100.*np.sum(moves)/float(n*n_chains),2),"%"
+
+      if outfile is not None:
+        self.Save(outfile, chain, ModelType, diagnostics, moves=moves,
+                  seeds=np.array([[-1 if seed is None else seed, j] for j in range(n_chains)]), P=P, step=S)
+      return chain, moves, diagnostics
+
+    def AutocorrTime(self, x, c=5.):
+      '''
+      Integrated autocorrelation time of the chains x, shape
+      (n_steps, n_chains), from their mean FFT autocorrelation, summed up to
+      the first lag M >= c*tau (Sokal's window). At least 1, which short or
+      near-constant chains can fall below.
+      '''
+      n         = len(x)
+      f         = np.fft.rfft(x - x.mean(axis=0), 2*n, axis=0)
+      acf       = np.fft.irfft(f*np.conj(f), axis=0)[:n].mean(axis=1)
+      if acf[0] <= 0.:
+        return float(n)
+      tau       = 2.*np.cumsum(acf/acf[0]) - 1.
+      window    = np.arange(n) >= c*tau
+      return max(tau[np.argmax(window)] if window.any() else tau[-1], 1.)
+
+    def SplitRhat(self, chains):
+      '''
+      Split-R_hat (Gelman et al. 2013) of each parameter of chains with
+      shape (n_steps, n_chains, n_params): the potential scale reduction
+      over the first and second halves of every chain.
+      '''
+      n         = len(chains)//2
+      if n < 2:
+        return np.inf*np.ones(chains.shape[2])
+      halves    = np.concatenate((chains[:n], chains[n:2*n]), axis=1)
+      W         = np.mean(np.var(halves, axis=0, ddof=1), axis=0)
+      B         = n*np.var(np.mean(halves, axis=0), axis=0, ddof=1)
+      with np.errstate(divide='ignore', invalid='ignore'):
+        r_hat   = np.sqrt(((n-1.)/n*W + B/n)/W)
+      return np.where(W > 0., r_hat, np.inf)
+
+    def Diagnostics(self, chains):
+      '''
+      Convergence diagnostics of chains with shape (n_steps, n_chains,
+      n_params): a dictionary of the split-R_hat, the integrated
+      autocorrelation time tau and the effective sample size
+      n_steps*n_chains/tau of each parameter. As tau >= 1 the effective
+      sample size is at most the number of samples.
+      '''
+      tau       = np.array([self.AutocorrTime(chains[:,:,i]) for i in range(chains.shape[2])])
+      n         = chains.shape[0]*chains.shape[1]
+      return {'r_hat': self.SplitRhat(chains), 'tau': tau, 'ess': np.minimum(n/tau, n)}
+
+    # Keys of the parameters in the chain files of LyMCMC.py, read by
+    # posterior.py, where they differ from the names of Model.param_names()
+    save_names = {'v_bp': 'v_H', 'nh_ism': 'nh_ISM', 'b_bp': 'b_BP', 'T_bp': 'T_BP'}
+
+    def Save(self, outfile, chains, ModelType, diagnostics, **metadata):
+      '''
+      Writes chains with shape (n_steps, n_chains, n_params) to the .npz
+      file outfile, with the parameter names, ModelType, the diagnostics and
+      any further metadata, e.g. the seeds and accepted steps of the chains.
+      The samples of each parameter, chain after chain, are also stored
+      under the keys of the chain files of LyMCMC.py (see save_names), so
+      that posterior.py reads the file like the concatenated chain files.
+      '''
+      names     = m.param_names(ModelType)[0]
+      metadata.update(diagnostics)
+      metadata.update((self.save_names.get(name, name), chains[:,:,i].T.ravel()) for i, name in enumerate(names))
+      np.savez(outfile, chains=chains, names=np.array(names), ModelType=str(ModelType), **metadata)
+
+    # Acceptance rate targeted by the adaptive proposal of McMC(), optimal
+    # for random walk Metropolis in many dimensions (Roberts et al. 1997)
+    target_acceptance = 0.234
+
+    class Proposal:
+      '''
+      Adaptive Gaussian proposal of McMC(). The covariance is that of the
+      chain so far, 2.38**2/n_params times, in units of the steps S, where
+      the parameters are of similar size. Before the chain has 10*n_params
+      samples it is the identity, i.e. the fixed proposal. From then on the
+      overall scale is adapted by Robbins-Monro steps towards
+      target_acceptance, counted from that step.
+      '''
+
+      def __init__(self, P, S):
+        self.S      = np.asarray(S, dtype=float)
+        self.n      = len(self.S)
+        self.mean   = np.asarray(P, dtype=float)/self.S
+        self.cov    = np.zeros((self.n,self.n))
+        self.chol   = np.eye(self.n)
+        self.scale  = 1.
+        self.start  = max(10*self.n-2, 0)
+
+      def jump(self):
+        ''' A random step in parameter units. '''
+        return self.scale*self.chol.dot(np.random.normal(0.,1.,self.n))*self.S
+
+      def update(self, P, moved, i):
+        ''' Adds the state P of step i, which moved or not, to the estimates. '''
+        y           = np.asarray(P)/self.S
+        d           = y-self.mean
+        self.mean  += d/(i+2.)
+        self.cov   += (np.outer(d, y-self.mean) - self.cov)/(i+2.)
+        if i >= self.start:
+          if i > self.start:
+            self.scale *= np.exp((moved - MCMC.target_acceptance)/float(i-self.start)**0.6)
+          try:
+            self.chol = np.linalg.cholesky(2.38**2/self.n*(self.cov + 1e-10*np.eye(self.n)))
+          except np.linalg.LinAlgError:
+            pass
+
+    def Blocks(self, ModelType):
+      '''
+      Groups the free parameters of ModelType into blocks that change one
+      model piece each: the stellar profile (max_f, uf, av), each absorber,
+      e.g. the disk (nh_bp, v_bp, b_bp, T_bp), the ISM (nh_ism) and
+      component X (v_X, nh_X), and the slope. Returns a list of
+      (piece, parameter indices).
+      '''
+      names   = m.param_names(ModelType)[0]
+      blocks  = []
+      pieces  = ['star','bp','ism','X'] + [c for c in m.absorbers(ModelType) if c not in ['bp','ism','X']]
+      for piece in pieces + ['slope']:
+        idx = [i for i in range(len(names)) if m.param_piece(names[i]) == piece]
+        if idx:
+          blocks.append((piece, np.array(idx)))
+      return blocks
+
+    def McMCBlocked(self, x, X, F, ModelType, P, Const, S, C):
+      '''
+      Metropolis-within-Gibbs version of McMC. Every step updates the
+      parameter blocks of Blocks() one after the other, and only the model
+      piece of the proposed block is recomputed before the pieces are
+      multiplied, convolved and compared with the data.
+
+      x => x-axis values (In this case wavelength)
+      X => Data (y,yerr,model)
+      F => Function used
+      P => Parameters
+      S => Scale
+      C => Chain length (number of sweeps through all blocks)
+
+      Returns the chain and the number of accepted block updates.
+      '''
+      P         = np.array(P, dtype=float)
+      S         = np.asarray(S, dtype=float)
+      blocks    = self.Blocks(ModelType)
+      p         = m.unpack(P, Const, ModelType)
+      pieces    = m.LyPieces(p, ModelType)
+      chi2      = s.chi2((X[0], X[1], m.LyCombine(p, ModelType, pieces)))
+      moves     = 0
+      chain     = np.zeros(shape=(int(C),len(P)))
+      for i in range(int(C)):
+        if i%100 == 0.:
+          print (i/float(C))*100.," % done"
+        for piece, idx in blocks:
+          P_new       = P.copy()
+          P_new[idx] += np.random.normal(0.,1.,len(idx)) * S[idx]
+          p_new       = m.unpack(P_new, Const, ModelType)
+          pieces_new  = dict(pieces)
+          pieces_new.update(m.LyPieces(p_new, ModelType, [piece]))
+          chi2_new    = s.chi2((X[0], X[1], m.LyCombine(p_new, ModelType, pieces_new)))
+
+          # Likelihood ratio exp(-chi2_new/2)/exp(-chi2/2)
+          if np.random.random() <= np.exp(-0.5*(chi2_new - chi2)):
+            P, pieces, chi2 = P_new, pieces_new, chi2_new
+            moves  += 1
+        chain[i,:] = P
+      print "\nAccepted block updates: ",round(100.*moves/(float(C)*len(blocks)),2),"%"
+
       return chain, moves
+
+    def McMCEnsemble(self, x, X, F, ModelType, P, Const, S, C, n_walkers=None, a=2., seed=None, lnprior=None,
+                     outfile=None):
+      '''
+      Affine-invariant ensemble sampler with stretch moves (Goodman & Weare
+      2010, as in emcee). The walkers are split in two halves; each half
+      is moved along lines through walkers of the other half, and all its
+      proposals are evaluated with one LyModelBatch call. The moves adapt
+      to the scale and correlations of the posterior, so S only sets the
+      spread of the starting walkers around P.
+
+      x => x-axis values (In this case wavelength)
+      X => Data (y,yerr,model)
+      F => Function used
+      P => Parameters
+      S => Scale of the initial walker positions
+      C => Chain length (number of steps of every walker)
+      n_walkers => Number of walkers, even and at least 2*len(P), by
+                   default 4*len(P)
+      a         => Stretch scale
+      seed      => Seed of the random number generator
+      lnprior   => Optional log prior as for McMC
+      outfile   => Optional .npz file for the chain, the chi2 of the samples
+                   and the Diagnostics() of its second half, see Save()
+
+      Returns the chain with shape (C, n_walkers, len(P)), the chi2 of
+      every sample (minus twice its log prior) with shape (C, n_walkers),
+      and the number of accepted moves. chain.reshape(-1,len(P)) has the layout of the McMC chain.
+      '''
+      P         = np.asarray(P, dtype=float)
+      n_dim     = len(P)
+      n_walkers = 4*n_dim if n_walkers is None else int(n_walkers)
+      if n_walkers % 2 or n_walkers < 2*n_dim:
+        raise ValueError("n_walkers must be even and at least %d, got %d" % (2*n_dim, n_walkers))
+      rng       = np.random.RandomState(seed)
+      F_obs, E  = X[0], X[1]
+
+      def chi2(Q):
+        c = np.sum(((F_obs - m.LyModelBatch(Q, Const, ModelType, components=False))/E)**2, axis=-1)
+        if lnprior is not None:
+          c = c - 2.*lnprior(Q)
+        return np.where(np.isnan(c), np.inf, c)
+
+      walkers   = P + np.asarray(S, dtype=float)*rng.normal(0.,1.,(n_walkers,n_dim))
+      chi2_w    = chi2(walkers)
+      halves    = [np.arange(n_walkers//2), np.arange(n_walkers//2, n_walkers)]
+      moves     = 0
+      chain     = np.zeros(shape=(int(C),n_walkers,n_dim))
+      chi2_chain = np.zeros(shape=(int(C),n_walkers))
+      for i in range(int(C)):
+        if i%100 == 0.:
+          print (i/float(C))*100.," % done"
+        for k in [0,1]:
+          move, other = halves[k], halves[1-k]
+          # z from g(z) ~ 1/sqrt(z) on [1/a, a]
+          z         = ((a-1.)*rng.random_sample(len(move)) + 1.)**2/a
+          partners  = walkers[other[rng.randint(len(other), size=len(move))]]
+          Y         = partners + z[:,None]*(walkers[move] - partners)
+          chi2_Y    = chi2(Y)
+          accept    = np.log(rng.random_sample(len(move))) < (n_dim-1.)*np.log(z) - 0.5*(chi2_Y - chi2_w[move])
+          walkers[move[accept]] = Y[accept]
+          chi2_w[move[accept]]  = chi2_Y[accept]
+          moves    += np.sum(accept)
+        chain[i]      = walkers
+        chi2_chain[i] = chi2_w
+      print "\nAccepted moves: ",round(100.*moves/(C*n_walkers),2),"%"
+
+      if outfile is not None:
+        self.Save(outfile, chain, ModelType, self.Diagnostics(chain[int(C)//2:]), chi2=chi2_chain, moves=moves,
+                  seed=-1 if seed is None else seed, P=P, step=S)
+
+      return chain, chi2_chain, moves
@@ -1,10 +1,99 @@
+import warnings
 import numpy as np
+from multiprocessing.pool import ThreadPool
 from scipy.special import wofz
+from scipy.signal import fftconvolve
+from scipy.ndimage import maximum_filter1d
+
+from src.convolution import Convolution, GridConvolution, TabulatedConvolution, LSFOperator
+from src.cache import LRUCache, fingerprint
+from src.voigt import Voigt
+from src.lines import LineList
+from src.clouds import Clouds
+from src import kernels
+
+vf  = Voigt()
+ll  = LineList()
 
 class Model:
     '''
     A collection of functions for modeling the line absorption.
     '''
+
+    # Number of LSF engines kept by lsf(), one per (W, l, sigma_kernel).
+    lsf_cache_size = 8
+
+    # Optional src.lsf.LSFTable, e.g. LSFTable().load(<COS LSF file>). When
+    # set, lsf() convolves with the tabulated, wavelength dependent LSF
+    # instead of the Gaussian of K(), and sigma_kernel is ignored.
+    lsf_table = None
+
+    # Voigt function used by emission() and absorption(): 'wofz' (exact),
+    # 'humlicek' or 'table'. See src/voigt.py for their accuracy. Set it on
+    # the class (Model.voigt_backend = ...) to change every Model instance.
+    voigt_backend = 'wofz'
+
+    # Number of fixed absorber transmissions kept by fixed_absorption().
+    absorption_cache_size = 16
+
+    # Floating point type of the Voigt functions, transmissions, stellar
+    # profile and LSF operator. With Model.dtype = np.float32 those are
+    # evaluated in single precision for exploratory MCMC and grid scans.
+    # Line offsets are still computed in double precision, as float32
+    # cannot resolve 1e-6 of a wavelength, and LyCombine() works in units
+    # of flux_scale so that the absorbed flux does not underflow.
+    dtype       = np.float64
+    flux_scale  = 1e-14
+
+    # Optional src.emulator.Emulator used by component_absorption() for
+    # absorbers with free parameters, e.g. Model.emulator = Emulator().
+    # Fixed absorbers and LyJacobian() always use the exact absorption().
+    emulator = None
+
+    # Evaluate emission() and absorption() of single parameter sets with
+    # the fused loops of src/kernels.py. They implement the Voigt function
+    # of the 'humlicek' backend only, so they need voigt_backend =
+    # 'humlicek' as well as numba; otherwise the NumPy path is used with a
+    # warning. For parameter arrays or dtype float32 the NumPy path is used.
+    jit = False
+
+    # LyPieces() splits model grids of thread_min or more points into
+    # n_threads wavelength chunks and evaluates them on a thread pool. Only
+    # the 'wofz' and 'humlicek' backends and the compiled kernels, which
+    # release the GIL, are threaded; with the emulator or the 'table'
+    # backend the pieces are computed serially. The LSF is applied once to
+    # the assembled pieces.
+    n_threads   = 1
+    thread_min  = 20000
+
+    def __init__(self):
+        self.lsf_cache          = LRUCache(self.lsf_cache_size)
+        self.absorption_cache   = LRUCache(self.absorption_cache_size)
+        self.transition_cache   = {}
+        self.pool               = None
+
+    def __del__(self):
+        self.close()
+
+    def thread_pool(self):
+        '''
+        The thread pool of chunk_pieces(), with n_threads threads. It is made
+        on first use and again, after closing the old one, when n_threads
+        has changed.
+        '''
+        if self.pool is not None and self.pool_threads != self.n_threads:
+            self.close()
+        if self.pool is None:
+            self.pool           = ThreadPool(self.n_threads)
+            self.pool_threads   = self.n_threads
+        return self.pool
+
+    def close(self):
+        ''' Stops the threads of thread_pool(), if any. '''
+        if getattr(self, 'pool', None) is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
         
     def voigt_wofz(self, a, u):
 
@@ -32,26 +121,157 @@ class Model:
                   " function for 0 < a < 0.1 (a=%g)" % a)  
              print(s)
         else:
-             return wofz(u + 1j * a).real
+             return wofz(np.asarray(u, dtype=self.dtype) + 1j * np.asarray(a, dtype=self.dtype)).real
+
+    # The LSF used by LyModel is truncated at n_sigma standard deviations,
+    # set to None to convolve with the full length kernel returned by K().
+    n_sigma = 8.
+
+    def voigt(self, a, u):
+        ''' Voigt function H(a,u) from the selected voigt_backend, in dtype. '''
+        if self.dtype == np.float64:
+            return vf(a, u, self.voigt_backend)
+        return vf(np.asarray(a, dtype=self.dtype), np.asarray(u, dtype=self.dtype), self.voigt_backend).astype(self.dtype, copy=False)
+
+    def use_jit(self, *params):
+        ''' True if the compiled kernels apply to the parameters, see jit. '''
+        if not self.jit:
+            return False
+        if not kernels.available or self.voigt_backend != 'humlicek':
+            warnings.warn("Model.jit needs numba and Model.voigt_backend = 'humlicek' (numba %s, backend '%s'); "
+                          "using the NumPy path" % ('installed' if kernels.available else 'not installed',
+                                                    self.voigt_backend))
+            return False
+        return self.dtype == np.float64 and all(np.ndim(x) == 0 for x in params)
+
+    def LSF_sigma(self, W, sigma_kernel):
+        ''' Standard deviation of the LSF in Angstrom. '''
+        dwave               = np.median((W-np.roll(W,1))[1:])   # Dispersion [Ang /pix]
+        return sigma_kernel*dwave/(2*np.sqrt(2*np.log(2.)))
+
+    # Velocity step [km/s] of the uniform model grids of LyFit.py and
+    # LyMCMC.py. K() puts the LSF centre len(W)/2 - (len(W)-1)//2 steps
+    # blueward of each output point (one step for even len(W)). The LSF on
+    # a non-uniform grid is offset by the same amount, so that the model
+    # does not move when the grid is changed with adaptive_grid().
+    grid_step = 1.
+
+    def LSF_offset(self, W, l):
+        ''' Offset in Angstrom of the LSF centre of K(), see grid_step. '''
+        if self.uniform(l):
+            dl  = np.mean((l-np.roll(l,1))[1:])
+        else:
+            dl  = np.mean(l)*self.grid_step/3e5
+        return (-len(W)/2. + (len(W)-1)//2)*dl
 
-    def K(self, W, l, sigma_kernel):
-        ''' LSF
-        Dispersion of the theoretical wavelength range
-        np.roll is equivalent to the IDL shift function
-        '''
+    def uniform(self, l):
+        ''' True if l is evenly spaced, as the grids of LyFit.py and LyMCMC.py. '''
+        dl = np.diff(l)
+        return np.ptp(dl) <= 1e-6*np.abs(np.mean(dl))
+
+    def K_sigma(self, W, l, sigma_kernel):
+        ''' Standard deviation of the LSF in units of pixels of l. '''
         # dl is the step size of the wavelength (l) in units of Angstrom
         # on which "kernel" is to be calculated.
         dl                  = np.mean((l-np.roll(l,1))[1:])
         dwave               = np.median((W-np.roll(W,1))[1:])   # Dispersion [Ang /pix]
         fwhm_cos_G130M_Ang  = sigma_kernel * dwave              # FWHM in Ang. 0.0648 Ang eq. to 6.5 pix.
         fwhm_cos_G130M_dl   = fwhm_cos_G130M_Ang / dl           # FWHM in Pix
-        c                   = fwhm_cos_G130M_dl/(2*np.sqrt(2*np.log(2.)))
+        return fwhm_cos_G130M_dl/(2*np.sqrt(2*np.log(2.)))
+
+    def K(self, W, l, sigma_kernel):
+        ''' LSF
+        Dispersion of the theoretical wavelength range
+        np.roll is equivalent to the IDL shift function
+        '''
+        c                   = self.K_sigma(W, l, sigma_kernel)
         kernel              = np.arange(-len(W)/2.,len(W)/2.,1) # W choosen but another value would also work like 500.
         kernel              = np.exp(-kernel**2/(2*c**2))
         kernel              = kernel/np.sum(kernel)     
         
         return kernel
 
+    def lsf(self, W, l, sigma_kernel):
+        '''
+        Returns a Convolution engine for the LSF of K(), truncated at
+        n_sigma standard deviations. The truncated kernel keeps the
+        sampling and centring of K(), so the result matches
+        np.convolve(f,K(W,l,sigma_kernel),mode='same').
+
+        On a non-uniform grid l, e.g. from adaptive_grid(), the engine is a
+        GridConvolution with the same LSF width and centring in Angstrom.
+        With lsf_table set it is a TabulatedConvolution, centred as K().
+
+        The engines are cached on a fingerprint of W, l, sigma_kernel,
+        n_sigma and lsf_table, so repeated model evaluations on the same
+        grid build the kernel (and its FFT) only once.
+        '''
+        key     = fingerprint(W, l, float(sigma_kernel), self.n_sigma, self.lsf_key())
+        engine  = self.lsf_cache.get(key)
+        if engine is None:
+            engine = self.lsf_cache.put(key, self.make_lsf(W, l, sigma_kernel))
+        return engine
+
+    def lsf_operator(self, W, l, sigma_kernel):
+        '''
+        Returns the LSFOperator that convolves a model spectrum on l with the
+        LSF of lsf() and interpolates it onto W in one sparse product, i.e.
+        interp(W,l,convolve(f,lsf(W,l,sigma_kernel))). Cached like lsf().
+        '''
+        key     = fingerprint('operator', W, l, float(sigma_kernel), self.n_sigma, self.lsf_key(), np.dtype(self.dtype).str)
+        op      = self.lsf_cache.get(key)
+        if op is None:
+            op = self.lsf_cache.put(key, LSFOperator(W, l, self.lsf(W, l, sigma_kernel), self.dtype))
+        return op
+
+    def lsf_key(self):
+        ''' Cache key of lsf_table, None for the Gaussian LSF. '''
+        return None if self.lsf_table is None else self.lsf_table.key
+
+    def make_lsf(self, W, l, sigma_kernel):
+        ''' Builds the truncated LSF Convolution engine returned by lsf(). '''
+        if self.lsf_table is not None:
+            return TabulatedConvolution(l, self.lsf_table, self.LSF_offset(W, l))
+        if not self.uniform(l):
+            return GridConvolution(l, self.LSF_sigma(W, sigma_kernel), self.n_sigma, self.LSF_offset(W, l))
+
+        kernel  = self.K(W,l,sigma_kernel)
+        if self.n_sigma is None:
+            return Convolution(kernel)
+
+        x       = np.arange(-len(W)/2.,len(W)/2.,1)
+        keep    = np.nonzero(np.abs(x) <= self.n_sigma*self.K_sigma(W,l,sigma_kernel))[0]
+        j0, j1  = keep[0], keep[-1]+1
+
+        return Convolution(kernel[j0:j1]/np.sum(kernel[j0:j1]), origin=(len(kernel)-1)//2 - j0)
+
+    def convolve(self, f, kernel):
+        ''' Convolves f with the LSF kernel, equivalent to
+        np.convolve(f,kernel,mode='same').
+
+        f may be a single spectrum or an (n_sets, len(l)) array of spectra,
+        in which case all rows are convolved in one FFT call. kernel is
+        either an array or a Convolution engine as returned by lsf().
+        '''
+        if isinstance(kernel, (Convolution, GridConvolution)):
+            return kernel(f)
+        if np.ndim(f) == 1:
+            return np.convolve(f,kernel,mode='same')
+        return fftconvolve(f,kernel.reshape((1,)*(np.ndim(f)-1)+(-1,)),mode='same',axes=-1)
+
+    def interp(self, W, l, f):
+        ''' Linear interpolation of f (given on l) onto W, equivalent to
+        np.interp(W,l,f).
+
+        f may be an (n_sets, len(l)) array, in which case the interpolation
+        weights are computed once and applied to all rows.
+        '''
+        if np.ndim(f) == 1:
+            return np.interp(W,l,f)
+        i   = np.clip(np.searchsorted(l,W)-1,0,len(l)-2)
+        t   = np.clip((W-l[i])/(l[i+1]-l[i]),0.,1.)
+        return f[...,i]*(1.-t) + f[...,i+1]*t
+
     def VoigtModel(self,params,Const):
 
         max_f, av, a, b    = params
@@ -131,56 +351,276 @@ class Model:
         
     def flux_star(self, LyA,BetaPicRV,l,kernel,max_f,dp,uf,av,continuum_fit):  
 
+        f       =   self.emission(LyA,BetaPicRV,l,max_f,dp,uf,av,continuum_fit)
+        f_star  =   self.convolve(f,kernel)
+        
+        return f, f_star
+
+    def emission(self, LyA,BetaPicRV,l,max_f,dp,uf,av,continuum_fit):
+        ''' The unconvolved stellar Ly-alpha profile of flux_star(). '''
+
         # Double Voigt profile
         delta_lambda =   LyA*(BetaPicRV/3e5)
          
         lambda0 =   LyA                     # Lyman alpha center
         lambda1 =   LyA -dp + delta_lambda  # blue peak center
         lambda2 =   LyA +dp + delta_lambda  # red peak center
+
+        if self.use_jit(max_f, uf, av, dp):
+            l       = np.asarray(l, dtype=float)
+            cont    = np.broadcast_to(np.asarray(continuum_fit, dtype=float), l.shape)
+            return kernels.emission(l, lambda1, lambda2, float(max_f), float(uf), float(av), cont, np.empty(l.shape))
+
+        # max_f, uf and av may be arrays of shape (n_sets,), in which case
+        # the profiles are returned with shape (n_sets, len(l)).
+        max_f, uf, av = [np.asarray(x)[...,None] for x in (max_f, uf, av)]
+
         u1      =   uf*(l-lambda1)          # blue peak wavelengths
         u2      =   uf*(l-lambda2)          # red peak wavelengths
 
-        f       =   max_f*(self.voigt_wofz(av,u1)+self.voigt_wofz(av,u2))
-        f       += continuum_fit
-        f_star  =   np.convolve(f,kernel,mode='same')
-        
-        return f, f_star
+        f       =   max_f.astype(self.dtype)*(self.voigt(av,u1)+self.voigt(av,u2))
+        f       =   f + np.asarray(continuum_fit, dtype=self.dtype)
+
+        return f
+
+    def emission_jacobian(self, LyA,BetaPicRV,l,max_f,dp,uf,av,continuum_fit):
+        '''
+        Derivatives of emission() with respect to max_f, uf and av, using
+        dH/du = Re w'(z) and dH/da = -Im w'(z) with w'(z) = -2z w(z) + 2i/sqrt(pi).
+        '''
+        delta_lambda =   LyA*(BetaPicRV/3e5)
+        dl1     =   l-(LyA -dp + delta_lambda)  # offsets from the blue peak
+        dl2     =   l-(LyA +dp + delta_lambda)  # offsets from the red peak
+
+        d       = {'max_f': 0., 'uf': 0., 'av': 0.}
+        for dl in (dl1, dl2):
+            z           = uf*dl + 1j*av
+            wz          = wofz(z)
+            dw          = -2.*z*wz + 2j/np.sqrt(np.pi)
+            d['max_f']  = d['max_f'] + wz.real
+            d['uf']     = d['uf'] + max_f*dw.real*dl
+            d['av']     = d['av'] - max_f*dw.imag
+        return d
         
 
+    # Constants of the absorption model
+    c_light = 2.99793e14
+    k_B     = 1.38064852e-23    # Boltzmann constant in J/K = m^2*kg/(s^2*K) in SI base units
+    amu     = 1.660539040e-27   # Atomic mass unit (Dalton) in kg
+
+    # Column density of D relative to H
+    D_H     = 1.5e-5
+
+    # With tau_min > 0, absorption() and line_absorption() evaluate the
+    # Voigt function of each line only where its optical depth can exceed
+    # tau_min, see line_depth(), and leave the transmission at exactly 1
+    # elsewhere. The transmission is then off by at most tau_min per line.
+    # Off by default: for the H+D ISM and beta Pic absorbers none of the
+    # grid falls below 1e-6 and the mask only costs time (see
+    # benchmark.sparse_tau()); it pays off for weak lines on wide grids.
+    # Only the NumPy path applies it, not the jit kernels, the emulator or
+    # src.workspace.Workspace.
+    tau_min = 0.
+
+    def transitions(self, LyA):
+        '''
+        Wavelength, mass, oscillator strength, damping constant and column
+        density relative to H of the [Hydrogen, Deuterium] transitions, as
+        column vectors, so that both transitions are evaluated on the whole
+        grid in a single (2, len(l)) pass. The H line sits at LyA. The
+        arrays are taken from the line list once per LyA and are read-only.
+        '''
+        if LyA not in self.transition_cache:
+            w, mass, fosc, delta = ll.columns([ll.find('HI', 1215.6702), ll.find('DI', 1215.3394)])
+            w[0]    = LyA
+            abund   = np.array([[1.],[self.D_H]])
+            for x in (w, mass, fosc, delta, abund):
+                x.flags.writeable = False
+            self.transition_cache[LyA] = w, mass, fosc, delta, abund
+        return self.transition_cache[LyA]
+
+    def doppler_width(self, vturb, T, mass):
+        ''' Line width parameter of optical_depth(), thermal and non-thermal. '''
+        return np.sqrt((T/mass) + ((vturb/np.sqrt(2*self.k_B/self.amu)/1e3)**2)) # non-thermal + thermal broadening
+
+    def optical_depth(self, l,v_bp,nh,vturb,T,LyA, derivatives=False, tau_min=0.):
+        '''
+        Optical depths of the [Hydrogen, Deuterium] transitions on l, with
+        shape (2, len(l)), or (n_sets, 2, len(l)) when v_bp, nh, vturb and
+        T are arrays of shape (n_sets,).
+
+        With derivatives=True a dictionary with the derivatives of the
+        optical depths with respect to v_bp ('v'), nh ('nh'), vturb ('b')
+        and T ('T') is returned as well.
+        '''
+        v_bp, nh, vturb, T = [np.asarray(x)[...,None,None] for x in (v_bp, nh, vturb, T)]
+
+        w, mass, fosc, delta, abund = self.transitions(LyA)
+        return self.line_depth(l, v_bp, abund*10**nh, vturb, T, w, mass, fosc, delta, derivatives, tau_min)
+
+    def line_depth(self, l,v_bp,N_col,vturb,T, w,mass,fosc,delta, derivatives=False, tau_min=0.):
+        '''
+        Optical depths on l of the lines with wavelength w, mass, oscillator
+        strength fosc and damping constant delta, given as (n_lines, 1)
+        column vectors, and column densities N_col. v_bp, N_col, vturb and T
+        broadcast against (n_lines, 1), with any leading parameter set axes.
+        All lines go through a single Voigt function call.
+
+        With tau_min > 0 the Voigt function is only evaluated at offsets
+        where the optical depth can reach tau_min, from the bound
+        H(a,u) <= exp(-u^2) + 2a/(sqrt(pi) u^2), and the optical depth is
+        set to 0 elsewhere.
+        '''
+        c       = self.c_light
+        k       = self.k_B
+        u       = self.amu
+
+        b_wid   = self.doppler_width(vturb, T, mass)
+        b       = 4.30136955e-3*b_wid
+        dnud    = b*c/w
+        xc      = l/(1.+v_bp*1.e9/c)
+        v       = 1.e4*np.abs(((c/xc)-(c/w))/dnud)
+        tv      = (1.16117705e-14*N_col*w*fosc/b_wid).astype(self.dtype)
+        a       = delta/dnud
+
+        if tau_min > 0 and not derivatives:
+            # Offset beyond which both terms of the bound on tv*H are
+            # below tau_min/2, e.g. a few Angstrom for D I
+            u_max   = np.maximum(np.sqrt(np.log(np.maximum(2.*tv/tau_min, 1.))),
+                                 np.sqrt(4.*tv*a/(np.sqrt(np.pi)*tau_min)))
+            near    = v < u_max
+            if not near.all():
+                hav         = np.zeros(near.shape, dtype=self.dtype)
+                tv, a, v    = [np.broadcast_to(x, near.shape)[near] for x in (tv, a, v)]
+                hav[near]   = tv*self.voigt(a, v)
+                return hav
+
+        hav     = tv*self.voigt(a,v)
+        #hav     = tv*self.Voigt(l,a,v)
+
+        if not derivatives:
+            return hav
+
+        # dH/du = Re w'(z) and dH/da = -Im w'(z), with w'(z) = -2z w(z) + 2i/sqrt(pi)
+        z       = v + 1j*a
+        dw      = -2.*z*wofz(z) + 2j/np.sqrt(np.pi)
+        H_u     = dw.real
+        H_a     = -dw.imag
+
+        # tv, v and a are all inversely proportional to b_wid
+        dhav_db = -(hav + tv*(H_u*v + H_a*a))/b_wid
+
+        d       = {}
+        d['nh'] = np.log(10.)*hav
+        d['v']  = tv*H_u*1.e4*np.sign((c/xc)-(c/w))*(1.e9/l)/dnud
+        d['b']  = dhav_db*vturb/((np.sqrt(2*k/u)*1e3)**2*b_wid)
+        d['T']  = dhav_db/(2.*mass*b_wid)
+
+        return hav, d
+
+    def line_absorption(self, l,v,logN,vturb,T, lines=ll):
+        '''
+        Transmission on l of a cloud at velocity v with log column densities
+        logN = {species: log N} for any of the species in the line list,
+        e.g. {'HI': 18.6, 'DI': 13.8, 'OI': 14.5}. All lines of those species
+        whose damping wings reach l, see LineList.reach(), are evaluated in
+        one stacked Voigt call; the others are skipped.
+
+        v, vturb, T and the values of logN may be arrays of shape (n_sets,),
+        in which case the transmission is returned with shape
+        (n_sets, len(l)).
+        '''
+        reach   = lines.reach(dict((sp, np.max(logN[sp])) for sp in logN), self.tau_min)
+        idx     = lines.window(np.min(l), np.max(l), reach)
+        idx     = idx[np.in1d(lines.species[idx], list(logN))]
+        v, vturb, T = [np.asarray(x, dtype=float)[...,None,None] for x in (v, vturb, T)]
+        if len(idx) == 0:
+            return np.ones(np.broadcast(v, vturb, T).shape[:-2]+(len(l),))
+
+        w, mass, fosc, delta = lines.columns(idx)
+        N_col   = 10**np.moveaxis(np.array([np.asarray(logN[sp], dtype=float) for sp in lines.species[idx]]), 0, -1)[...,None]
+        hav     = self.line_depth(l, v, N_col, vturb, T, w, mass, fosc, delta, tau_min=self.tau_min)
+
+        # Optical depths of 20 or more are treated as fully absorbed, as in
+        # absorption().
+        return np.where(hav < 20., np.exp(-np.minimum(hav, 20.)), 0.).prod(axis=-2)
+
     def absorption(self, l,v_bp,nh,vturb,T,LyA):
-        
-        # [Hydrogen, Deuterium]   
-        w       = [LyA,1215.3394]
-        mass    = [1.,2.]
-        fosc    = [0.416,0.416]
-        delta   = np.array([0.627e9,0.627e9]) /(4.*np.pi)
-        N_col   = np.array([1.,1.5e-5])*10**nh
-        c       = 2.99793e14
-        k       = 1.38064852e-23    # Boltzmann constant in J/K = m^2*kg/(s^2*K) in SI base units
-        u       = 1.660539040e-27   # Atomic mass unit (Dalton) in kg
-
-        abs_ism = np.ones(len(l))
-
-        for i in range(len(w)):
-            b_wid   = np.sqrt((T/mass[i]) + ((vturb/np.sqrt(2*k/u)/1e3)**2)) # non-thermal + thermal broadening
-            b       = 4.30136955e-3*b_wid
-            dnud    = b*c/w[i]
-            xc      = l/(1.+v_bp*1.e9/c)
-            v       = 1.e4*abs(((c/xc)-(c/w[i]))/dnud)
-            tv      = 1.16117705e-14*N_col[i]*w[i]*fosc[i]/b_wid
-            a       = delta[i]/dnud
-            hav     = tv*self.voigt_wofz(a,v)
-            #hav     = tv*self.Voigt(l,a,v)
-            
-            # To avoid underflow which occurs when you have exp(small negative number)
-            for j in range(len(hav)):
-                if hav[j] < 20.:      
-                    abs_ism[j]  =   abs_ism[j]*np.exp(-hav[j])       
-                else:
-                    abs_ism[j]  =   0.
-                    
-        return abs_ism
 
+        if self.use_jit(v_bp, nh, vturb, T):
+            w, mass, fosc, delta, abund = self.transitions(LyA)
+            l       = np.asarray(l, dtype=float)
+            b_wid   = self.doppler_width(vturb, T, mass[:,0])
+            return kernels.absorption(l, float(v_bp), self.c_light, abund[:,0]*10**nh, b_wid,
+                                      w[:,0], fosc[:,0], delta[:,0], np.empty(l.shape))
+
+        # v_bp, nh, vturb and T may be arrays of shape (n_sets,), in which
+        # case the transmission is returned with shape (n_sets, len(l)).
+        hav     = self.optical_depth(l,v_bp,nh,vturb,T,LyA, tau_min=self.tau_min)
+
+        # To avoid underflow which occurs when you have exp(small negative number)
+        # optical depths of 20 or more are treated as fully absorbed.
+        abs_ism = np.where(hav < 20., np.exp(-np.minimum(hav, 20.)), 0.)
+
+        return abs_ism.prod(axis=-2)
+
+    def absorption_jacobian(self, l,v_bp,nh,vturb,T,LyA):
+        '''
+        Returns the transmission of absorption() and a dictionary with its
+        derivatives with respect to v_bp ('v'), nh ('nh'), vturb ('b') and
+        T ('T'). Where a transition is saturated (tau >= 20) both the
+        transmission and its derivatives are zero.
+        '''
+        hav, d  = self.optical_depth(l,v_bp,nh,vturb,T,LyA, derivatives=True)
+        abs_c   = np.where(hav < 20., np.exp(-np.minimum(hav, 20.)), 0.).prod(axis=-2)
+
+        return abs_c, dict((key, -abs_c*d[key].sum(axis=-2)) for key in d)
+
+    def fixed_absorption(self, l,v_bp,nh,vturb,T,LyA):
+        '''
+        absorption() for a component whose parameters are all fixed. The
+        transmission is computed once per grid and parameter set and then
+        reused, e.g. for the ISM in ModelTypes 1-4 on every MCMC step. The
+        returned array is read-only.
+        '''
+        key     = fingerprint(l, float(v_bp), float(nh), float(vturb), float(T), float(LyA), self.voigt_backend, np.dtype(self.dtype).str, self.use_jit(), self.tau_min)
+        abs_c   = self.absorption_cache.get(key)
+        if abs_c is None:
+            abs_c = self.absorption(l,v_bp,nh,vturb,T,LyA)
+            abs_c.flags.writeable = False
+            self.absorption_cache.put(key, abs_c)
+        return abs_c
+
+    def fixed_absorber(self, c, ModelType):
+        ''' True if absorber c has no free parameters in ModelType. '''
+        return set(n+'_'+c for n in Clouds.cloud_params).isdisjoint(self.param_names(ModelType)[0])
+
+    def component_absorption(self, p, c, ModelType):
+        '''
+        Transmission of absorber c (e.g. 'ism', 'bp' or 'X') for the
+        parameter dictionary p. Components without free parameters in
+        ModelType are taken from fixed_absorption(), the others from the
+        emulator when one is set.
+        '''
+        args    = [p['l']] + [p[n+'_'+c] for n in Clouds.cloud_params] + [p['LyA']]
+        if self.fixed_absorber(c, ModelType):
+            return self.fixed_absorption(*args)
+        if self.emulator is not None:
+            return self.emulator.absorption(*args)
+        return self.absorption(*args)
+
+    def cloud_absorption(self, p, clouds):
+        '''
+        Transmissions of the absorbers clouds for the parameter dictionary
+        p, with shape (..., len(clouds), len(l)). The optical depths of all
+        clouds and transitions are computed in one call, as an
+        (..., n_clouds, n_transitions, len(l)) array.
+        '''
+        args    = [np.stack(np.broadcast_arrays(*[np.asarray(p[n+'_'+c], dtype=float) for c in clouds]), axis=-1)
+                   for n in Clouds.cloud_params]
+        if self.emulator is not None:
+            return self.emulator.absorption(p['l'], *args+[p['LyA']])
+        return self.absorption(p['l'], *args+[p['LyA']])
 
     def LyModel(self, params, Const, ModelType):
         
@@ -230,108 +670,332 @@ class Model:
         Same as ModelType = 6, but with the 20.5 km/s column density locked.
         Used in the referee response.
         ========================================================================   
+
+        ModelType may also be a src.clouds.Clouds instance, which declares
+        any number of absorbing clouds and their free parameters.
         '''
         
-        # Free parameters
-        if ModelType == 1:
-            nh_bp, max_f, uf, av, slope                     = params
+        p = self.unpack(params, Const, ModelType)
 
-        if ModelType == 2:
-            nh_bp, max_f, uf, av, v_bp                      = params
-            
-        if ModelType == 3:
-            nh_bp, max_f, uf, av, v_X, nh_X                 = params
+        return self.LySpectra(p, ModelType)
 
-        if ModelType == 4:
-            nh_bp, max_f, uf, av                            = params
+    def LyLikelihoodModel(self, params, Const, ModelType):
+        '''
+        Returns only the absorbed, convolved model on the COS wavelengths W,
+        i.e. LyModel(params, Const, ModelType)[0], without computing the
+        diagnostic components. Used by the fitting and MCMC routines.
+        '''
+        p = self.unpack(params, Const, ModelType)
 
-        if ModelType == 5:
-            nh_bp, max_f, uf, av, v_bp, nh_ism              = params
+        return self.LySpectra(p, ModelType, components=False)
 
-        if ModelType == 6:
-            nh_bp, max_f, uf, av, v_X, nh_X, nh_ism         = params
- 
-        if ModelType == 7:
-            max_f, uf, av, v_X, nh_X, nh_ism                = params
+    def LyModelBatch(self, params, Const, ModelType, components=True):
+        '''
+        Evaluates LyModel for many parameter vectors at once.
 
-        if ModelType == 8:
-            nh_bp, max_f, uf, av, v_bp, nh_ism, b_bp,T_bp   = params
+        params is an (n_sets, n_params) array, one row per parameter vector,
+        ordered as for LyModel. Returns the same components as LyModel, each
+        as an (n_sets, n_pix) array, or with components=False only the
+        (n_sets, n_pix) array of absorbed spectra.
+        '''
+        params  = np.atleast_2d(np.asarray(params, dtype=float))
+        p       = self.unpack(params.T, Const, ModelType)
 
-        # Fixed parameters
-        if ModelType == 1:
-            W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,nh_ism,b_ism,T_ism,v_bp,b_bp,T_bp,continuum_fit           = Const
+        return self.LySpectra(p, ModelType, components)
 
-        if ModelType == 2:
-            W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,nh_ism,b_ism,T_ism,b_bp,T_bp,continuum_fit                = Const
-            
-        if ModelType == 3:
-            W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,nh_ism,b_ism,T_ism,v_bp,b_bp,T_bp,b_X,T_X,continuum_fit   = Const
+    def adaptive_grid(self, params, Const, ModelType, tol=1e-4, dl_max=None):
+        '''
+        Returns a copy of Const with the model grid l replaced by a
+        non-uniform grid for the parameters params, and continuum_fit
+        interpolated onto it.
+
+        The unconvolved model is evaluated on the (fine, uniform) grid l of
+        Const, and the new grid is spaced so that linear interpolation of
+        it, and of its LSF convolution, errs by about tol of its peak:
+        h = sqrt(8 tol/|f''|), which is dense in the stellar and H/D line
+        cores and sparse in the wings. The
+        spacing is capped at dl_max, by default half the LSF standard
+        deviation, so that the trapezoidal LSF convolution of
+        GridConvolution stays accurate. The grid covers W and n_sigma LSF
+        standard deviations either side, which is all LyCombine() needs.
+
+        params may be an (n_sets, n_params) array, e.g. the start and a few
+        perturbed parameter vectors of a fit, in which case the grid is
+        fine enough for all of them.
+        '''
+        params  = np.atleast_2d(np.asarray(params, dtype=float))
+        p       = self.unpack(params.T, Const, ModelType)
+        W, l    = p['W'], np.asarray(p['l'])
+        sigma   = self.LSF_sigma(W, p['sigma_kernel'])
+        dl_max  = 0.5*sigma if dl_max is None else dl_max
+
+        pieces  = self.LyPieces(p, ModelType)
+        f       = pieces['star']
+        for c in self.absorbers(ModelType):
+            f       = f*pieces[c]
+        f       = np.atleast_2d(f)/np.abs(f).max(axis=-1)[...,None]
+
+        # |f''| h^2/8 = tol, with f'' from second differences on l, for the
+        # model before and after the LSF convolution, which is interpolated
+        # onto W.
+        f       = np.concatenate((f, self.convolve(f, self.lsf(W,l,p['sigma_kernel']))))
+        dl      = np.diff(l)
+        d2      = np.zeros(len(l))
+        d2[1:-1] = np.abs(np.diff(np.diff(f,axis=-1)/dl,axis=-1)/(0.5*(dl[1:]+dl[:-1]))).max(axis=0)
+        d2      = maximum_filter1d(d2, 5)
+        h       = np.clip(np.sqrt(8.*tol/np.maximum(d2, 1e-300)), 0.1*dl.min(), dl_max)
+
+        # Points spaced by h: equal steps in the integral of 1/h over l
+        reach   = (self.n_sigma or 8.)*sigma if self.lsf_table is None else self.lsf_table.reach()
+        keep    = (l >= W.min()-reach-dl_max) & (l <= W.max()+reach+dl_max)
+        x, h    = l[keep], h[keep]
+        N       = np.concatenate(([0.], np.cumsum(np.diff(x)*0.5*(1./h[1:]+1./h[:-1]))))
+        l_new   = np.interp(np.linspace(0., N[-1], int(np.ceil(N[-1]))+1), N, x)
+
+        fixed   = self.param_names(ModelType)[1]
+        Const   = list(Const)
+        Const[fixed.index('continuum_fit')] = np.interp(l_new, l, np.broadcast_to(p['continuum_fit'], l.shape))
+        Const[fixed.index('l')]             = l_new
+        return Const
+
+    # Free (params) and fixed (Const) parameters of each ModelType, in order.
+    free_params = {
+        1: ['nh_bp','max_f','uf','av','slope'],
+        2: ['nh_bp','max_f','uf','av','v_bp'],
+        3: ['nh_bp','max_f','uf','av','v_X','nh_X'],
+        4: ['nh_bp','max_f','uf','av'],
+        5: ['nh_bp','max_f','uf','av','v_bp','nh_ism'],
+        6: ['nh_bp','max_f','uf','av','v_X','nh_X','nh_ism'],
+        7: ['max_f','uf','av','v_X','nh_X','nh_ism'],
+        8: ['nh_bp','max_f','uf','av','v_bp','nh_ism','b_bp','T_bp']}
+
+    fixed_params = {
+        1: ['W','l','LyA','BetaPicRV','sigma_kernel','dp','v_ism','nh_ism','b_ism','T_ism','v_bp','b_bp','T_bp','continuum_fit'],
+        2: ['W','l','LyA','BetaPicRV','sigma_kernel','dp','v_ism','nh_ism','b_ism','T_ism','b_bp','T_bp','continuum_fit'],
+        3: ['W','l','LyA','BetaPicRV','sigma_kernel','dp','v_ism','nh_ism','b_ism','T_ism','v_bp','b_bp','T_bp','b_X','T_X','continuum_fit'],
+        4: ['W','l','LyA','BetaPicRV','sigma_kernel','dp','v_ism','nh_ism','b_ism','T_ism','v_bp','b_bp','T_bp','continuum_fit'],
+        5: ['W','l','LyA','BetaPicRV','sigma_kernel','dp','v_ism','b_ism','T_ism','b_bp','T_bp','continuum_fit'],
+        6: ['W','l','LyA','BetaPicRV','sigma_kernel','dp','v_ism','b_ism','T_ism','v_bp','b_bp','T_bp','b_X','T_X','continuum_fit'],
+        7: ['W','l','LyA','BetaPicRV','sigma_kernel','dp','v_ism','b_ism','T_ism','nh_bp','v_bp','b_bp','T_bp','b_X','T_X','continuum_fit'],
+        8: ['W','l','LyA','BetaPicRV','sigma_kernel','dp','v_ism','b_ism','T_ism','continuum_fit']}
+
+    def param_names(self, ModelType):
+        ''' Names of the free and of the fixed parameters of ModelType. '''
+        if isinstance(ModelType, Clouds):
+            return ModelType.free, ModelType.fixed
+        return self.free_params[ModelType], self.fixed_params[ModelType]
+
+    def absorbers(self, ModelType):
+        ''' Names of the absorbers of ModelType, in the order of LyModel(). '''
+        if isinstance(ModelType, Clouds):
+            return ModelType.clouds
+        return ['ism','bp'] + (['X'] if ModelType in [3,6,7] else [])
+
+    def unpack(self, params, Const, ModelType):
+        '''
+        Returns a dictionary of all free and fixed parameters of ModelType.
+        '''
+        free, fixed = self.param_names(ModelType)
+        if len(params) != len(free) or len(Const) != len(fixed):
+            raise ValueError("ModelType %s expects %d free and %d fixed parameters, got %d and %d"
+                             % (ModelType, len(free), len(fixed), len(params), len(Const)))
+        p = dict(zip(fixed, Const))
+        p.update(zip(free, params))
+        return p
+
+    # Model piece changed by each free parameter: the stellar profile, the
+    # transmission of one absorber, or the slope applied after convolution.
+    param_pieces = {'max_f':'star', 'uf':'star', 'av':'star',
+                    'nh_bp':'bp', 'v_bp':'bp', 'b_bp':'bp', 'T_bp':'bp',
+                    'nh_ism':'ism', 'v_X':'X', 'nh_X':'X', 'slope':'slope'}
+
+    def param_piece(self, name):
+        ''' Model piece changed by the free parameter name, e.g. 'Y' for nh_Y. '''
+        return self.param_pieces.get(name, name.split('_',1)[-1])
+
+    def threaded(self, l):
+        ''' True if LyPieces() evaluates the grid l in chunks, see n_threads. '''
+        return (self.n_threads > 1 and len(l) >= self.thread_min and self.emulator is None
+                and self.voigt_backend in ['wofz','humlicek'])
+
+    def LyPieces(self, p, ModelType, names=None, serial=False):
+        '''
+        Returns a dictionary of the unconvolved model pieces on l: the
+        stellar profile 'star' and the transmissions of the absorbers, e.g.
+        'ism', 'bp' and, for ModelTypes 3, 6 and 7, 'X'. names restricts the
+        computation to the listed pieces, so that a sampler can update only
+        what changed. With serial=True the grid is never split over threads.
+
+        Absorbers with free parameters go through cloud_absorption()
+        together when there is more than one of them.
+        '''
+        if names is None:
+            names = ['star'] + self.absorbers(ModelType)
+        if not serial and self.threaded(p['l']):
+            return self.chunk_pieces(p, ModelType, names)
+
+        pieces = {}
+        free    = [name for name in names if name not in ['star','slope'] and not self.fixed_absorber(name, ModelType)]
+        if len(free) > 1:
+            abs_c   = self.cloud_absorption(p, free)
+            for i, name in enumerate(free):
+                pieces[name] = abs_c[...,i,:]
+
+        for name in names:
+            if name in pieces:
+                continue
+            if name == 'star':
+                # Stellar Ly-alpha line
+                pieces['star'] = self.emission(p['LyA'],p['BetaPicRV'],p['l'],p['max_f'],p['dp'],p['uf'],p['av'],p['continuum_fit'])
+            elif name != 'slope':
+                # Components whose parameters are all fixed are only
+                # computed once per run.
+                pieces[name] = self.component_absorption(p,name,ModelType)
+        return pieces
+
+    def chunk_pieces(self, p, ModelType, names):
+        '''
+        LyPieces() with the grid split into n_threads chunks that are
+        evaluated on the thread pool. Transmissions of absorbers without
+        free parameters come from fixed_absorption() for the whole grid.
+        '''
+        l       = np.asarray(p['l'])
+        pieces  = {}
+        for name in names:
+            if name not in ['star','slope'] and self.fixed_absorber(name, ModelType):
+                pieces[name] = self.component_absorption(p,name,ModelType)
+        rest    = [name for name in names if name not in pieces and name != 'slope']
+
+        bounds  = np.linspace(0, len(l), self.n_threads+1).astype(int)
+        chunks  = []
+        for i0, i1 in zip(bounds[:-1], bounds[1:]):
+            q       = dict(p)
+            q['l']  = l[i0:i1]
+            if np.ndim(p['continuum_fit']) > 0:
+                q['continuum_fit'] = np.asarray(p['continuum_fit'])[...,i0:i1]
+            chunks.append(q)
+
+        results = self.thread_pool().map(lambda q: self.LyPieces(q, ModelType, rest, serial=True), chunks)
+        for name in rest:
+            pieces[name] = np.concatenate([r[name] for r in results], axis=-1)
+        return pieces
+
+    def LyCombine(self, p, ModelType, pieces):
+        '''
+        Multiplies the stellar profile with the transmissions in pieces,
+        convolves the result with the LSF and interpolates it onto the COS
+        wavelengths W with one LSFOperator product, i.e. the likelihood
+        model of LyLikelihoodModel().
+        '''
+        W, l        = p['W'], p['l']
+        operator    =   self.lsf_operator(W,l,p['sigma_kernel'])
 
-        if ModelType == 4:
-            W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,nh_ism,b_ism,T_ism,v_bp,b_bp,T_bp,continuum_fit           = Const
+        # In single precision the flux is in units of flux_scale, so that
+        # the absorbed flux does not underflow.
+        f_abs       =   pieces['star'] if self.dtype == np.float64 else pieces['star']/self.flux_scale
+        for c in self.absorbers(ModelType):
+            f_abs       =   f_abs*pieces[c]
 
-        if ModelType == 5:
-            W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,b_ism,T_ism,b_bp,T_bp,continuum_fit                       = Const
-            #W,l,LyA,BetaPicRV,sigma_kernel,mu,RV,v_ism,b_ism,T_ism,b_bp,T_bp,continuum_fit = Const
-        
-        if ModelType == 6:
-            W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,b_ism,T_ism,v_bp,b_bp,T_bp,b_X,T_X,continuum_fit          = Const
+        f_abs_int   =   operator(f_abs)
+        if self.dtype != np.float64:
+            f_abs_int   =   f_abs_int.astype(float)*self.flux_scale
+        if 'slope' in p:
+            f_abs_int   =   f_abs_int*(W*np.asarray(p['slope'])[...,None]+1.0)
 
-        if ModelType == 7:
-            W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,b_ism,T_ism,nh_bp,v_bp,b_bp,T_bp,b_X,T_X,continuum_fit    = Const
+        return f_abs_int
 
-        if ModelType == 8:
-            W,l,LyA,BetaPicRV,sigma_kernel,dp,v_ism,b_ism,T_ism,continuum_fit                                 = Const
+    def LyJacobian(self, params, Const, ModelType):
+        '''
+        Analytic Jacobian of LyLikelihoodModel() with respect to the free
+        parameters, as an (n_pix, n_params) array.
+
+        The derivatives of the stellar profile and of the transmissions on
+        l follow from the derivative of the Faddeeva function. As the LSF
+        convolution and the interpolation onto W are linear, the derivative
+        spectra of all parameters go through the LSFOperator together in
+        one sparse product.
+        '''
+        p           = self.unpack(params, Const, ModelType)
+        names       = self.param_names(ModelType)[0]
+        W, l, LyA   = p['W'], p['l'], p['LyA']
+        operator    = self.lsf_operator(W,l,p['sigma_kernel'])
+
+        comps       = self.absorbers(ModelType)
+        pieces      = {'star': self.emission(LyA,p['BetaPicRV'],l,p['max_f'],p['dp'],p['uf'],p['av'],p['continuum_fit'])}
+        d_pieces    = {'star': self.emission_jacobian(LyA,p['BetaPicRV'],l,p['max_f'],p['dp'],p['uf'],p['av'],p['continuum_fit'])}
+        for c in comps:
+            pieces[c], d_pieces[c] = self.absorption_jacobian(l,p['v_'+c],p['nh_'+c],p['b_'+c],p['T_'+c],LyA)
+
+        spectra = []
+        for name in names + ['model']:
+            if name == 'slope':
+                continue
+            if name == 'model':
+                d = pieces['star']
+            elif self.param_piece(name) == 'star':
+                d = d_pieces['star'][name]
+            else:
+                d = pieces['star']*d_pieces[self.param_piece(name)][name.split('_')[0]]
+            for c in comps:
+                if name == 'model' or c != self.param_piece(name):
+                    d = d*pieces[c]
+            spectra.append(d)
+
+        con     = operator(np.array(spectra))
+        J       = con[:-1]
+
+        if 'slope' in names:
+            # model = interp(conv(f_abs))*(W*slope+1.0)
+            J   = np.insert(J*(W*p['slope']+1.0), names.index('slope'), con[-1]*W, axis=0)
+
+        return J.T
+
+    def LySpectra(self, p, ModelType, components=True):
+        '''
+        Computes the LyModel components from the parameter dictionary p
+        returned by unpack(). Free parameters may be scalars or arrays of
+        shape (n_sets,).
 
-        kernel      =   self.K(W,l,sigma_kernel)
+        With components=False only the absorbed spectrum on W is computed
+        and returned, which is all a likelihood evaluation needs.
+        '''
+        pieces      =   self.LyPieces(p, ModelType)
+        if not components:
+            return self.LyCombine(p, ModelType, pieces)
 
-        # Calculates the ISM absorption
-        abs_ism     =   self.absorption(l,v_ism,nh_ism,b_ism,T_ism,LyA)
-        abs_bp      =   self.absorption(l,v_bp,nh_bp,b_bp,T_bp,LyA)
-        
-        if ModelType in [3,6,7]:
-            abs_X       =   self.absorption(l,v_X,nh_X,b_X,T_X,LyA)
+        W, l        = p['W'], p['l']
+        kernel      =   self.lsf(W,l,p['sigma_kernel'])
 
-        # Stellar Ly-alpha line
-        f, f_star   =   self.flux_star(LyA,BetaPicRV,l,kernel,max_f,dp,uf,av,continuum_fit)
+        f           =   pieces['star']
+        comps       =   self.absorbers(ModelType)
 
         #f, f_star   = self.GaussianDouble(params,Const)
-       
+
         # Stellar spectral profile, as seen from Earth
         # after absorption by the ISM and BP CS disk.
         # Profile has been convolved with HST LSF
         #    -  in (erg cm-2 s-1 A-1)
-
-
-        if ModelType in [3,6,7]:
-            f_abs_con   =   np.convolve(f*abs_ism*abs_bp*abs_X, kernel, mode='same')
-        else:
-            f_abs_con   =   np.convolve(f*abs_ism*abs_bp, kernel, mode='same')
-        
-        # Absorption by the ISM
-        if ModelType == 1:
-            f_abs_ism   =   np.convolve(f*abs_ism, kernel, mode='same')*(l*slope+1.0)
-        else:
-            f_abs_ism   =   np.convolve(f*abs_ism, kernel, mode='same')
-        
-        # Absorption by beta Pictoris  
-        if ModelType == 1:
-            f_abs_bp    =   np.convolve(f*abs_bp, kernel, mode='same')*(l*slope+1.0)
-        else:
-            f_abs_bp    =   np.convolve(f*abs_bp, kernel, mode='same')
-
-        # Absorption by component X  
-        if ModelType in [3,6,7]:
-            f_abs_X    =   np.convolve(f*abs_X, kernel, mode='same')
+        # The absorbed profile, the stellar profile and the profiles
+        # absorbed by each absorber alone (the ISM, beta Pictoris and
+        # component X) are convolved together in one call.
+        f_abs       =   f
+        for c in comps:
+            f_abs       =   f_abs*pieces[c]
+        spectra     =   [f_abs, f] + [f*pieces[c] for c in comps]
+        con         =   self.convolve(np.stack(spectra, axis=-2), kernel)
+
+        f_abs_con   =   con[...,0,:]
+        f_comps     =   [con[...,i,:] for i in range(1, len(spectra))]
+
+        if 'slope' in p:
+            slope       =   np.asarray(p['slope'])[...,None]
+            f_comps     =   [f_c*(l*slope+1.0) for f_c in f_comps]
         
         # Interpolation on COS wavelengths, relative to the star
-        if ModelType == 1:
-            f_abs_int   =   np.interp(W,l,f_abs_con)*(W*slope+1.0)
-            f_star      =   f_star*(l*slope+1.0)
-        else:
-            f_abs_int   =   np.interp(W,l,f_abs_con)
-                    
-        if ModelType in [3,6,7]:
-            return f_abs_int, f_star, f_abs_ism, f_abs_bp, f_abs_X
+        if 'slope' in p:
+            f_abs_int   =   self.interp(W,l,f_abs_con)*(W*slope+1.0)
         else:
-            return f_abs_int, f_star, f_abs_ism, f_abs_bp
+            f_abs_int   =   self.interp(W,l,f_abs_con)
+
+        # f_abs_int, f_star and the profiles absorbed by each absorber
+        return tuple([f_abs_int] + f_comps)
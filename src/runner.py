@@ -0,0 +1,122 @@
+import time
+import numpy as np
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+from src.model import Model
+from src.mcmc import MCMC
+from src.workspace import Workspace
+
+m   = Model()
+mc  = MCMC()
+
+# Job of the worker processes, set by init_worker(): the data, constants
+# and output of Runner.run() as views of shared memory, and the sampler
+# settings.
+job = {}
+
+def share(a):
+    '''
+    Copies the array a into shared memory. Returns the shared buffer and
+    the shape, from which view() rebuilds the array without a copy.
+    '''
+    a       = np.ascontiguousarray(a, dtype=float)
+    buf     = RawArray('d', max(a.size, 1))
+    view((buf, a.shape))[...] = a
+    return buf, a.shape
+
+def view(shared):
+    ''' NumPy view of a (buffer, shape) pair made by share(). '''
+    buf, shape = shared
+    return np.frombuffer(buf, dtype=float, count=int(np.prod(shape))).reshape(shape)
+
+def init_worker(X, Const, out, settings):
+    '''
+    Pool initializer: X and Const hold (buffer, shape) pairs in place of
+    their arrays, which the workers inherit instead of receiving pickled
+    copies.
+    '''
+    unshare     = lambda v: view(v) if isinstance(v, tuple) else v
+    job.update(settings)
+    job['X']        = tuple(unshare(v) for v in X)
+    job['Const']    = [unshare(v) for v in Const]
+    job['out']      = view(out)
+    job['workspace']= Workspace(job['Const'], job['ModelType']) if settings['workspace'] else None
+
+def run_chain(i):
+    '''
+    Runs chain i of the job with MCMC.McMC() into the shared output, with
+    the random stream seeded by (seed, i). Returns the accepted moves and
+    the run time.
+    '''
+    np.random.seed([job['seed'], i])
+    t0          = time.time()
+    chain, moves= mc.McMC(job['Const'][0], job['X'], m.LyModel, job['ModelType'], job['P'], job['Const'],
+                          job['S'], job['C'], workspace=job['workspace'], lnprior=job['lnprior'],
+                          adapt=job['adapt'])
+    job['out'][i] = chain
+    return moves, time.time()-t0
+
+class Runner:
+    '''
+    Runs several MCMC.McMC() chains over a pool of processes, e.g. the 24
+    chains of LyMCMC.py in one command:
+
+        chains, moves = Runner().run(X, ModelType, Par, Const, step, 167000, 24,
+                                     outfile='chains/chains_Q.npz')
+
+    which is what "LyMCMC.py all" runs. posterior.py reads the outfile like
+    the 24 chain files of single runs, see MCMC.Save().
+
+    The spectra, grid and continuum arrays in X and Const are copied to
+    shared memory once and inherited by the workers, and every chain writes
+    into one shared output array. Chain i draws from np.random seeded by
+    (seed, i), so the chains are independent and a run is reproducible for
+    any number of processes.
+    '''
+
+    def __init__(self, n_processes=None):
+        '''
+        n_processes => Number of worker processes, by default one per CPU
+        '''
+        self.n_processes = n_processes or multiprocessing.cpu_count()
+
+    def run(self, X, ModelType, P, Const, S, C, n_chains, seed=0, outfile=None, workspace=False, lnprior=None, adapt=0):
+        '''
+        X, ModelType, P, Const, S, C, lnprior and adapt as for MCMC.McMC(),
+        C being the length of each chain.
+
+        n_chains    => Number of chains
+        seed        => Seed of the random streams of the chains
+        outfile     => Optional .npz file for the chains, their metadata and
+                       the MCMC.Diagnostics() of the second half of each
+                       chain, see MCMC.Save()
+        workspace   => If True each worker evaluates the likelihood in a
+                       src.workspace.Workspace
+
+        Returns the chains with shape (C, n_chains, len(P)), as
+        MCMC.McMCChains(), and the accepted moves of each chain.
+        '''
+        C           = int(C)
+        shared      = lambda v: share(v) if isinstance(v, np.ndarray) else v
+        out         = share(np.zeros((n_chains, C, len(P))))
+        settings    = dict(ModelType=ModelType, P=np.array(P, dtype=float), S=np.array(S, dtype=float), C=C,
+                           seed=seed, lnprior=lnprior, workspace=workspace, adapt=adapt)
+
+        pool        = multiprocessing.Pool(min(self.n_processes, n_chains), init_worker,
+                                           ([shared(v) for v in X], [shared(v) for v in Const], out, settings))
+        try:
+            results = pool.map(run_chain, range(n_chains), chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        # Each chain was written contiguously, as out[i]
+        chains      = view(out).transpose(1,0,2)
+        moves       = np.array([r[0] for r in results])
+        if outfile is not None:
+            diagnostics = mc.Diagnostics(chains[max(C//2, min(adapt, C-4)):])
+            mc.Save(outfile, chains, ModelType, diagnostics, moves=moves,
+                    seeds=np.array([[seed, i] for i in range(n_chains)]),
+                    run_time=np.array([r[1] for r in results]), P=settings['P'], step=settings['S'])
+        return chains, moves
@@ -18,9 +18,22 @@ class Stats:
         return np.sum(((X[0] - X[2]) / X[1])**2.)
 
     def chi2_lm(self, params,F,E,Const, ModelType):
-        c = m.LyModel(params,Const, ModelType)[0]
+        c = m.LyLikelihoodModel(params,Const, ModelType)
         return (c - F)**2 / E**2
 
+    def chi2_lm_jac(self, params,F,E,Const, ModelType):
+        '''
+        Jacobian of chi2_lm with respect to params, shape (n_pix, n_params).
+        Can be passed to scipy.optimize.leastsq as Dfun, with
+        diag=1./np.maximum(np.abs(params), 1.) so that MINPACK does not scale
+        its steps by the column norms, see LyFit.FindBestParams(jacobian=True).
+        Forward differences are the default there; benchmark.jacobian()
+        compares the two.
+        '''
+        c = m.LyLikelihoodModel(params,Const, ModelType)
+        J = m.LyJacobian(params,Const, ModelType)
+        return (2.*(c - F) / E**2)[:,None] * J
+
     def chi2Mods(self, params,F,E,Const, ModelType):
         if ModelType == 'Voigt':
             c = m.VoigtModel(params, Const)
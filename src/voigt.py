@@ -0,0 +1,110 @@
+import numpy as np
+from scipy.special import wofz
+
+class Voigt:
+    '''
+    Approximations to the Voigt function H(a,u) = Re[w(u + ia)], where w is
+    the Faddeeva function, used as alternatives to scipy's wofz().
+
+    Over 1e-4 <= a <= 10 and 0 <= u <= 5000, which covers the absorbers
+    (a ~ 1e-3, u up to several thousand in the far wings) and the stellar
+    profile (a ~ 5, u up to ~1000) of ModelTypes 1-8, the relative error
+    against wofz() is below 1e-6 for humlicek (asymptotic expansion and
+    Weideman N=32) and below 1e-4 for table (log H interpolated on an
+    801 x 1201 grid). Both are evaluated with NumPy array operations and
+    are not faster than scipy's compiled wofz, which stays the default;
+    benchmark.voigt() measures their errors and throughput.
+    '''
+
+    # Weideman (1994) rational approximation with N terms.
+    N       = 32
+    L       = np.sqrt(N/np.sqrt(2.))
+
+    # Region of the (a, u) plane covered by the lookup table. Outside it
+    # (|z| >= table_max) the asymptotic expansion of w(z) is used.
+    table_max   = 12.
+    table_a_min = 1e-5
+
+    def __init__(self):
+        # Weideman coefficients
+        M       = 2*self.N
+        k       = np.arange(-M+1, M)
+        t       = self.L*np.tan(k*np.pi/(2.*M))
+        f       = np.concatenate(([0.], np.exp(-t**2)*(self.L**2+t**2)))
+        a       = np.real(np.fft.fft(np.fft.fftshift(f)))/(2*M)
+        self.weideman_coeffs = a[1:self.N+1][::-1]
+
+        self.grid = None
+
+    def wofz(self, a, u):
+        ''' Exact Voigt function from scipy.special.wofz(). '''
+        return wofz(u + 1j*a).real
+
+    def asymptotic(self, z):
+        ''' Asymptotic expansion of w(z) for large |z|, Im(z) > 0. '''
+        iz2 = 1./(z*z)
+        return 1j/(np.sqrt(np.pi)*z)*(1. + iz2*(0.5 + iz2*(0.75 + iz2*(1.875 + iz2*6.5625))))
+
+    def weideman(self, z):
+        ''' Weideman (1994) rational approximation of w(z), Im(z) > 0. '''
+        Lz  = self.L - 1j*z
+        Z   = (self.L + 1j*z)/Lz
+        p   = np.polyval(self.weideman_coeffs, Z)
+        return 2.*p/Lz**2 + 1./(np.sqrt(np.pi)*Lz)
+
+    def humlicek(self, a, u):
+        '''
+        Voigt function from Humlicek's region I approximation (here the
+        asymptotic expansion) for |u|+a >= 10 and Weideman's rational
+        approximation with N=32 elsewhere (cf. Schreier 2011).
+        '''
+        z       = np.asarray(u) + 1j*np.asarray(a)
+        out     = np.empty(z.shape)
+        far     = (np.abs(z.real) + z.imag) >= 10.
+        out[far]    = self.asymptotic(z[far]).real
+        out[~far]   = self.weideman(z[~far]).real
+        return out
+
+    def make_table(self, n_a=801, n_u=1201):
+        '''
+        Tabulates log H(a,u) from wofz() on a grid uniform in log a and in u,
+        covering table_a_min <= a <= table_max and 0 <= u <= table_max.
+        '''
+        loga    = np.linspace(np.log(self.table_a_min), np.log(self.table_max), n_a)
+        u       = np.linspace(0., self.table_max, n_u)
+        logH    = np.log(self.wofz(np.exp(loga)[:,None], u[None,:]))
+        self.grid = loga, u, logH
+        return self.grid
+
+    def table(self, a, u):
+        '''
+        Voigt function by bilinear interpolation of log H on the
+        precomputed (log a, u) grid, and from the asymptotic expansion
+        outside it. a is clamped to table_a_min.
+        '''
+        if self.grid is None:
+            self.make_table()
+        loga, ug, logH = self.grid
+
+        a, u    = np.broadcast_arrays(np.asarray(a, dtype=float), np.abs(np.asarray(u, dtype=float)))
+        out     = np.empty(a.shape)
+        far     = (u >= self.table_max) | (a >= self.table_max)
+        out[far] = self.asymptotic(u[far] + 1j*a[far]).real
+
+        near    = ~far
+        x       = (np.log(np.maximum(a[near], self.table_a_min)) - loga[0])/(loga[1]-loga[0])
+        y       = u[near]/(ug[1]-ug[0])
+        i       = np.minimum(x.astype(int), len(loga)-2)
+        j       = np.minimum(y.astype(int), len(ug)-2)
+        x, y    = x-i, y-j
+        out[near] = np.exp((1.-x)*((1.-y)*logH[i,j] + y*logH[i,j+1]) + x*((1.-y)*logH[i+1,j] + y*logH[i+1,j+1]))
+        return out
+
+    def __call__(self, a, u, backend='wofz'):
+        if backend == 'wofz':
+            return self.wofz(a, u)
+        if backend == 'humlicek':
+            return self.humlicek(*np.broadcast_arrays(a, u))
+        if backend == 'table':
+            return self.table(a, u)
+        raise ValueError("Unknown Voigt backend '%s', use 'wofz', 'humlicek' or 'table'" % backend)
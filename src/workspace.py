@@ -0,0 +1,138 @@
+import numpy as np
+from scipy.special import wofz
+
+from src.model import Model
+
+m   = Model()
+
+class Workspace:
+    '''
+    Preallocated buffers for repeated likelihood evaluations on one grid,
+    e.g. the steps of an MCMC run.
+
+    model() gives the result of Model.LyLikelihoodModel() and chi2() the
+    chi2 of the data, both computed with in-place ufuncs (out=) into
+    buffers sized to l and W, so that a step creates no temporaries on the
+    model grid; only the sparse LSF product allocates its result on W. The LSF operator, the line data and the transmissions of
+    absorbers without free parameters are looked up once, when the
+    workspace is made.
+
+    The result is that of LyLikelihoodModel() with the default Model
+    settings only: the Voigt function is always scipy's wofz(), in double
+    precision, on every pixel, without the jit kernels or the emulator. A
+    workspace is therefore not made while Model.voigt_backend, dtype,
+    tau_min, jit or emulator are changed from their defaults.
+
+    The returned arrays are overwritten by the next call.
+    '''
+
+    def __init__(self, Const, ModelType):
+        changed = [name for name, value, default in [('voigt_backend', Model.voigt_backend, 'wofz'),
+                                                     ('dtype', np.dtype(Model.dtype), np.dtype(np.float64)),
+                                                     ('tau_min', Model.tau_min, 0.),
+                                                     ('jit', Model.jit, False),
+                                                     ('emulator', Model.emulator, None)] if value != default]
+        if changed:
+            raise ValueError("Workspace only reproduces LyLikelihoodModel with the default Model settings, "
+                             "but Model.%s changed" % ', Model.'.join(changed))
+        self.ModelType  = ModelType
+        self.names      = m.param_names(ModelType)[0]
+        self.p          = m.unpack(np.zeros(len(self.names)), Const, ModelType)
+        p               = self.p
+
+        self.l          = np.asarray(p['l'], dtype=float)
+        self.W          = np.asarray(p['W'], dtype=float)
+        self.inv_l      = 1./self.l
+        self.operator   = m.lsf_operator(self.W, self.l, p['sigma_kernel'])
+        self.lines      = m.transitions(p['LyA'])
+
+        # Transmission of the absorbers without free parameters
+        self.comps      = m.absorbers(ModelType)
+        self.fixed      = {}
+        for c in self.comps:
+            if m.fixed_absorber(c, ModelType):
+                self.fixed[c] = m.component_absorption(p, c, ModelType)
+
+        n, n_W          = len(self.l), len(self.W)
+        self.f          = np.empty(n)
+        self.u          = np.empty(n)
+        self.tau        = np.empty(n)
+        self.saturated  = np.empty(n, dtype=bool)
+        self.z          = np.empty(n, dtype=complex)
+        self.wz         = np.empty(n, dtype=complex)
+        self.out        = np.empty(n_W)
+        self.resid      = np.empty(n_W)
+        self.continuum  = np.broadcast_to(p['continuum_fit'], self.l.shape)
+
+    def voigt(self, a, out):
+        ''' H(a, u) for the offsets already in self.u, into out. '''
+        self.z.real[:]  = self.u
+        self.z.imag[:]  = a
+        wofz(self.z, out=self.wz)
+        out[:]          = self.wz.real
+        return out
+
+    def emission(self, max_f, dp, uf, av):
+        ''' Model.emission() into self.f. '''
+        p               = self.p
+        delta_lambda    = p['LyA']*(p['BetaPicRV']/3e5)
+        self.f[:]       = self.continuum
+        for centre in (p['LyA'] - dp + delta_lambda, p['LyA'] + dp + delta_lambda):
+            np.subtract(self.l, centre, out=self.u)
+            self.u     *= uf
+            self.voigt(av, self.tau)
+            self.tau   *= max_f
+            self.f     += self.tau
+        return self.f
+
+    def absorb(self, v_bp, nh, vturb, T):
+        ''' Multiplies self.f with the transmission of Model.absorption(). '''
+        w, mass, fosc, delta, abund = self.lines
+        c       = m.c_light
+        for i in range(len(w)):
+            b_wid   = m.doppler_width(vturb, T, mass[i,0])
+            dnud    = 4.30136955e-3*b_wid*c/w[i,0]
+
+            # u = 1e4*|c/xc - c/w|/dnud with xc = l/(1+v_bp*1e9/c)
+            np.multiply(self.inv_l, c*(1.+v_bp*1.e9/c), out=self.u)
+            self.u -= c/w[i,0]
+            np.abs(self.u, out=self.u)
+            self.u *= 1.e4/dnud
+
+            self.voigt(delta[i,0]/dnud, self.tau)
+            self.tau *= 1.16117705e-14*abund[i,0]*10**nh*w[i,0]*fosc[i,0]/b_wid
+
+            # Optical depths of 20 or more are fully absorbed
+            np.greater_equal(self.tau, 20., out=self.saturated)
+            np.negative(self.tau, out=self.tau)
+            np.exp(self.tau, out=self.tau)
+            self.tau[self.saturated] = 0.
+            self.f *= self.tau
+        return self.f
+
+    def model(self, params):
+        ''' Model.LyLikelihoodModel(params, Const, ModelType). '''
+        p = self.p
+        p.update(zip(self.names, params))
+
+        self.emission(p['max_f'], p['dp'], p['uf'], p['av'])
+        for c in self.comps:
+            if c in self.fixed:
+                self.f *= self.fixed[c]
+            else:
+                self.absorb(p['v_'+c], p['nh_'+c], p['b_'+c], p['T_'+c])
+
+        self.out[:] = self.operator.matrix.dot(self.f)
+
+        if 'slope' in p:
+            np.multiply(self.W, p['slope'], out=self.resid)
+            self.resid += 1.
+            self.out   *= self.resid
+        return self.out
+
+    def chi2(self, params, F, E):
+        ''' Chi2 of the data F with errors E, as Stats.chi2(). '''
+        self.model(params)
+        np.subtract(F, self.out, out=self.resid)
+        self.resid /= E
+        return np.dot(self.resid, self.resid)
@@ -0,0 +1,83 @@
+import os
+import numpy as np
+
+class ChainWriter:
+    '''
+    Writes an MCMC chain to disk while it is sampled, see MCMC.McMC(outfile=...).
+
+    The chain is a .npy file of shape (C, n_params), made when the run
+    starts, so np.load(filename, mmap_mode='r') opens it at any time.
+    Rows are written in blocks of `block` steps. After each block a
+    checkpoint with the number of steps done and the sampler state is
+    saved next to it as filename+'.checkpoint.npz'. A run restarted with
+    the same filename continues from the last checkpoint, unless resume is
+    False. Only one block of the chain is held in memory.
+    '''
+
+    def __init__(self, filename, C, n_params, block=1000, resume=True):
+        '''
+        filename    => .npy file of the chain
+        C           => Chain length
+        n_params    => Number of parameters
+        block       => Number of steps per write and checkpoint
+        resume      => If True an unfinished run with a checkpoint is
+                       continued, and a finished one raises a ValueError
+                       rather than being returned without sampling. If
+                       False the file and checkpoint are overwritten.
+        '''
+        self.filename   = filename
+        self.checkpoint = filename + '.checkpoint.npz'
+        self.shape      = (int(C), int(n_params))
+        self.block      = int(block)
+
+        if not resume and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        if os.path.exists(self.checkpoint):
+            shape   = np.load(self.filename, mmap_mode='r').shape
+            if shape != self.shape:
+                raise ValueError("Cannot resume %s of shape %s as a chain of shape %s"
+                                 % (self.filename, shape, self.shape))
+            if self.load()[0] >= self.shape[0]:
+                raise ValueError("The chain %s is already complete; pass resume=False to sample it again"
+                                 % self.filename)
+        else:
+            # Allocates the file without holding the chain in memory
+            chain   = np.lib.format.open_memmap(self.filename, mode='w+', dtype=float, shape=self.shape)
+            del chain
+
+        with open(self.filename, 'rb') as f:
+            np.lib.format.read_magic(f)
+            np.lib.format.read_array_header_1_0(f)
+            self.offset = f.tell()
+
+    def write(self, i, rows):
+        ''' Writes rows as the steps from i on and flushes them to disk. '''
+        rows    = np.ascontiguousarray(rows, dtype=float)
+        with open(self.filename, 'r+b') as f:
+            f.seek(self.offset + i*rows.itemsize*self.shape[1])
+            f.write(rows.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save(self, i, **state):
+        '''
+        Saves the checkpoint after step i with the arrays in state, replacing
+        the previous one only once it is complete.
+        '''
+        tmp     = self.checkpoint + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, i=i, **state)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.checkpoint)
+
+    def load(self):
+        ''' The number of steps done and the state of the last checkpoint, or 0 and None. '''
+        if not os.path.exists(self.checkpoint):
+            return 0, None
+        state   = dict(np.load(self.checkpoint))
+        return int(state.pop('i')), state
+
+    def chain(self):
+        ''' The chain written so far, as a read-only memory map. '''
+        return np.load(self.filename, mmap_mode='r')